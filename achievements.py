@@ -0,0 +1,84 @@
+"""
+Достижения: реестр правил, привязанных к событиям.
+
+При событии (новая заявка, выполненное задание, заказ, изменение баллов)
+проверяются только правила, подписанные на это событие, по счетчикам User.
+Новое достижение - одна запись @rule, без правок в роутах.
+"""
+from collections import namedtuple
+from typing import Callable, Dict, List
+from models import User
+
+
+class AchievementEvent:
+    """События, на которые подписываются правила"""
+    PROBLEM_REPORTED = 'problem_reported'
+    TASK_COMPLETED = 'task_completed'
+    ORDER_CREATED = 'order_created'
+    POINTS_CHANGED = 'points_changed'
+
+
+Rule = namedtuple('Rule', 'name icon check')
+
+RULES: Dict[str, List[Rule]] = {}
+
+
+def rule(name: str, icon: str, *events: str):
+    """Регистрирует условие достижения name для событий events"""
+    def register(check: Callable[[User], bool]):
+        for event in events:
+            RULES.setdefault(event, []).append(Rule(name, icon, check))
+        return check
+    return register
+
+
+def fire(user: User, *events: str) -> List[str]:
+    """
+    Проверить правила, подписанные на события, и выдать заработанные достижения.
+    Возвращает названия новых достижений. Commit выполняет вызывающий код.
+    """
+    awarded = []
+    for event in events:
+        for r in RULES.get(event, ()):
+            if not user.has_achievement(r.name) and r.check(user):
+                user.add_badge(r.name, r.icon)
+                awarded.append(r.name)
+    return awarded
+
+
+def check_all(user: User) -> List[str]:
+    """Проверить все правила (например, для пересчета достижений пользователя)"""
+    return fire(user, *RULES)
+
+
+# --- Правила ---
+
+@rule('Первая проблема', 'fa-map-marker-alt', AchievementEvent.PROBLEM_REPORTED)
+def _first_report(user):
+    return (user.total_reports or 0) >= 1
+
+
+@rule('10 проблем', 'fa-flag', AchievementEvent.PROBLEM_REPORTED)
+def _ten_reports(user):
+    return (user.total_reports or 0) >= 10
+
+
+@rule('5 решений', 'fa-check-circle', AchievementEvent.TASK_COMPLETED)
+def _five_completed(user):
+    return (user.total_completed or 0) >= 5
+
+
+@rule('Богатый волонтер', 'fa-coins', AchievementEvent.POINTS_CHANGED)
+def _rich(user):
+    return (user.points or 0) >= 500
+
+
+# Опыт начисляется за заявки и выполненные задания
+@rule('Опытный волонтер', 'fa-star', AchievementEvent.PROBLEM_REPORTED, AchievementEvent.TASK_COMPLETED)
+def _experienced(user):
+    return (user.experience or 0) >= 1000
+
+
+@rule('Первый заказ', 'fa-shopping-bag', AchievementEvent.ORDER_CREATED)
+def _first_order(user):
+    return True
@@ -0,0 +1,99 @@
+"""
+Аналитика: агрегаты считаются в БД (GROUP BY / ORDER BY LIMIT),
+в Python попадает только небольшой результат
+"""
+import math
+from typing import List, Optional
+from sqlalchemy import Integer, case, cast, func
+from models import db, User, Problem
+from markers import filter_bbox
+from geo import BBox
+
+# Предел точек, отдаваемых для карты аналитики за один запрос
+MAX_ANALYTICS_POINTS = 5000
+
+# Тепловая карта: допустимый шаг сетки (в градусах) и предел числа ячеек в области.
+# Если при запрошенном шаге ячеек получается больше, шаг увеличивается.
+HEATMAP_MIN_STEP = 0.0005
+HEATMAP_MAX_STEP = 5.0
+HEATMAP_DEFAULT_STEP = 0.01
+MAX_HEATMAP_CELLS = 10000
+
+
+def severity_breakdown() -> dict:
+    """Количество проблем по уровням важности (одним запросом)"""
+    severity = db.session.query(
+        func.sum(case((Problem.severity >= 5, 1), else_=0)),
+        func.sum(case((Problem.severity == 4, 1), else_=0)),
+        func.sum(case((Problem.severity == 3, 1), else_=0)),
+        func.sum(case((Problem.severity <= 2, 1), else_=0)),
+    ).one()
+    return {
+        'Критический': severity[0] or 0,
+        'Высокий': severity[1] or 0,
+        'Средний': severity[2] or 0,
+        'Низкий': severity[3] or 0
+    }
+
+
+def top_reporters(limit: int = 5) -> List[User]:
+    return User.query.order_by(User.total_reports.desc()).limit(limit).all()
+
+
+def analytics_points(bbox: Optional[BBox], limit: int = MAX_ANALYTICS_POINTS) -> List[dict]:
+    """Последние проблемы (включая выполненные) в области карты, не больше limit"""
+    query = filter_bbox(Problem.query, bbox).with_entities(
+        Problem.id, Problem.lat, Problem.lng, Problem.title, Problem.category,
+        Problem.severity, Problem.status)
+    rows = query.order_by(Problem.created_at.desc()).limit(min(limit, MAX_ANALYTICS_POINTS)).all()
+    return [{
+        'id': r.id,
+        'lat': r.lat,
+        'lng': r.lng,
+        'title': r.title,
+        'category': r.category,
+        'severity': r.severity,
+        'status': r.status
+    } for r in rows]
+
+
+def heatmap_step(bbox: Optional[BBox], step: Optional[float]) -> float:
+    """Шаг сетки тепловой карты с учетом допустимых пределов и размера области"""
+    step = min(HEATMAP_MAX_STEP, max(HEATMAP_MIN_STEP, step or HEATMAP_DEFAULT_STEP))
+    south, west, north, east = bbox or (-90.0, -180.0, 90.0, 180.0)
+    area_cells = max(north - south, step) * max(east - west, step) / (step * step)
+    if area_cells > MAX_HEATMAP_CELLS:
+        step = min(HEATMAP_MAX_STEP, step * math.sqrt(area_cells / MAX_HEATMAP_CELLS))
+    return step
+
+
+def snap_bbox(bbox: Optional[BBox], step: float) -> Optional[BBox]:
+    """Расширить bbox до границ ячеек сетки, чтобы соседние запросы попадали в один кэш"""
+    if bbox is None:
+        return None
+    south, west, north, east = bbox
+    return (max(-90.0, math.floor(south / step) * step), max(-180.0, math.floor(west / step) * step),
+            min(90.0, math.ceil(north / step) * step), min(180.0, math.ceil(east / step) * step))
+
+
+def heatmap_grid(query, bbox: Optional[BBox], step: float, category: Optional[str] = None) -> dict:
+    """
+    Плотность проблем по ячейкам сетки lat/lng с шагом step (в градусах).
+    Разбиение выполняется в БД (GROUP BY по номеру ячейки), вес ячейки - сумма важности.
+    query - базовый запрос проблем (например, уже с фильтром по датам).
+    Возвращает только непустые ячейки: [центр lat, центр lng, вес, количество].
+    """
+    query = filter_bbox(query, bbox)
+    if category:
+        query = query.filter(Problem.category == category)
+
+    row = cast((Problem.lat + 90) / step, Integer)
+    col = cast((Problem.lng + 180) / step, Integer)
+    rows = (query.with_entities(row, col, func.sum(Problem.severity), func.count(Problem.id))
+            .group_by(row, col).all())
+
+    return {
+        'step': step,
+        'cells': [[round((r + 0.5) * step - 90, 6), round((c + 0.5) * step - 180, 6), weight or 0, count]
+                  for r, c, weight, count in rows]
+    }
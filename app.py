@@ -1,21 +1,42 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
 import os
-import requests
-import random
 import secrets
 import json
+import click
 
 # Импорт конфигурации и моделей
 from config import Config
-from models import db, User, Problem, Complaint, Comment, TaskCompletion, Order, Vote, SensorData
+from models import db, User, Problem, Complaint, Comment, TaskCompletion, Order, Vote, SensorData, PointsTransaction
 
 # Импорт новых модулей
 from decorators import admin_required
-from constants import ProblemStatus, ProblemSeverity, ProblemCategory, OrderStatus, ComplaintStatus, ConfigDefaults
-from utils import save_uploaded_file, get_coordinates_from_request, json_response, is_valid_image_file
+from constants import (ProblemStatus, ProblemSeverity, ProblemCategory, OrderStatus, ComplaintStatus, ConfigDefaults,
+                       StatsMetric, PointsReason)
+from utils import save_uploaded_file, get_coordinates_from_request, json_response, is_valid_image_file, parse_id_list
+from geo import viewport_from_request
+from markers import (get_markers, get_delta, parse_cursor, record_deletions, marker_snapshot,
+                     encode_json, columnar_markers, binary_markers, problem_details, marker_dict,
+                     find_nearby, problem_states, MAX_STATE_IDS)
+from events import event_hub
+from pagination import keyset_page, filter_date_range, parse_date
+from analytics import (severity_breakdown, top_reporters, analytics_points, MAX_ANALYTICS_POINTS,
+                       heatmap_step, snap_bbox, heatmap_grid)
+import stats
+from timeseries import BUCKET_SIZES, METRICS, bucket_range, time_series, timeseries_cache
+from clusters import cluster_cache, cluster_zoom
+from points import award as award_points, spend as spend_points, deduct_up_to, set_balance
+import points
+import challenges
+import votes
+import sensors
+from achievements import AchievementEvent, fire as fire_achievements
+from leaderboard import user_rank, users_around, rank_entry, leaderboards
+from migrations import run_migrations, check_query_plans
+from querylog import init_query_counter
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -24,6 +45,7 @@ app.config.from_object(Config)
 db.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+init_query_counter(app, db)
 
 # Создание папки для загрузок, если нет
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
@@ -44,6 +66,85 @@ def inject_global_vars():
         'OrderStatus': OrderStatus
     }
 
+def problems_changed(*problems, everything: bool = False):
+    """
+    Сбросить кэши карты после изменения проблем или их счетчиков голосов (вызывать после commit).
+    everything=True - при массовых изменениях, когда затронутые проблемы неизвестны.
+    """
+    marker_snapshot.bump()
+    if everything:
+        cluster_cache.clear()
+        return
+    for problem in problems:
+        cluster_cache.invalidate_point(problem.lat, problem.lng)
+
+def votes_flushed(problem_ids):
+    """После записи пачки голосов из буфера: сбросить кэши карты и разослать новые счетчики"""
+    problems_changed()
+    for problem_id, (likes, dislikes) in votes.counts(problem_ids).items():
+        event_hub.publish('votes_changed', {'id': problem_id, 'likes': likes, 'dislikes': dislikes})
+
+votes.vote_buffer.init_app(app, on_flush=votes_flushed)
+sensors.init_app(app)
+
+def problem_stat_days(problem_ids):
+    """Дни ежедневной сводки, которые затрагивает удаление проблем (создание, выполнение, жалобы)"""
+    days = set()
+    for created_at, completed_at in db.session.query(Problem.created_at, Problem.completed_at).filter(Problem.id.in_(problem_ids)):
+        days.update(d.date() for d in (created_at, completed_at) if d)
+    for (created_at,) in db.session.query(Complaint.created_at).filter(Complaint.problem_id.in_(problem_ids)):
+        if created_at:
+            days.add(created_at.date())
+    return days
+
+def publish_problem_status(problem):
+    """Событие смены статуса/исполнителя проблемы для подписчиков /api/stream"""
+    event_hub.publish('problem_status_changed', {
+        'id': problem.id,
+        'status': problem.status,
+        'assigned_to': problem.assigned_to
+    })
+
+def map_response():
+    """
+    Ответ API карты по параметрам запроса: список маркеров (из версионного снимка),
+    при cluster=1 и мелком масштабе - кластеры по ячейкам сетки,
+    при since=<курсор> - только изменения маркеров с момента курсора
+    """
+    bbox, zoom = viewport_from_request(request)
+    cluster_max_zoom = app.config.get('MAP_CLUSTER_MAX_ZOOM', ConfigDefaults.MAP_CLUSTER_MAX_ZOOM)
+    if request.args.get('cluster') and bbox and zoom is not None and zoom <= cluster_max_zoom:
+        # Для слишком большой области кластеры строятся на более мелком масштабе
+        zoom = cluster_zoom(bbox, zoom, cluster_cache.max_zoom)
+        return jsonify({'mode': 'cluster', 'zoom': zoom, 'clusters': cluster_cache.get_clusters(bbox, zoom)})
+    since = parse_cursor(request.args.get('since'))
+    if since is not None:
+        return jsonify(get_delta(since, bbox))
+
+    # format=columnar|binary - компактные форматы без описаний (детали: /api/problems/<id>)
+    fmt = request.args.get('format')
+    if fmt == 'binary':
+        build, mimetype = (lambda: binary_markers(bbox)), 'application/octet-stream'
+    elif fmt == 'columnar':
+        build, mimetype = (lambda: encode_json(columnar_markers(bbox))), 'application/json'
+    else:
+        fmt = 'json'
+        build, mimetype = (lambda: encode_json(get_markers(bbox))), 'application/json'
+
+    # Курсор для последующих запросов since= передается в заголовке
+    etag, body, cursor = marker_snapshot.get((fmt, bbox), build)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['X-Map-Cursor'] = str(cursor)
+    if fmt == 'binary':
+        # Таблицы кодов категорий и статусов для разбора бинарных записей
+        response.headers['X-Marker-Categories'] = ','.join(ProblemCategory.CODES)
+        response.headers['X-Marker-Statuses'] = ','.join(ProblemStatus.ALL)
+    return response
+
 # ==========================================
 # РОУТЫ СТРАНИЦ (РЕНДЕРИНГ)
 # ==========================================
@@ -62,23 +163,35 @@ def map_view():
 @login_required
 @admin_required
 def admin_panel():
-    users = User.query.all()
-    problems = Problem.query.all()
-    complaints = Complaint.query.filter_by(status=ComplaintStatus.PENDING).all()
-    tasks = Problem.query.filter(Problem.status != ProblemStatus.COMPLETED).all()
+    # В таблицы попадает только первая страница, остальное подгружается через
+    # /api/admin/users, /api/admin/problems и /api/complaints/all; счетчики - агрегатами в БД
+    users, users_cursor = keyset_page(User.query, User, request)
+    problems, problems_cursor = keyset_page(Problem.query, Problem, request)
+    pending_query = (Complaint.query.options(joinedload(Complaint.problem), joinedload(Complaint.user))
+                     .filter_by(status=ComplaintStatus.PENDING))
+    complaints, complaints_cursor = keyset_page(pending_query, Complaint, request)
+    tasks_query = Problem.query.filter(Problem.status != ProblemStatus.COMPLETED)
+    tasks, _ = keyset_page(tasks_query, Problem, request)
     
-    total_points = sum(u.points for u in users)
-    new_points_today = sum(1 for p in problems if p.created_at.date() == datetime.utcnow().date())
+    today = datetime.utcnow().date()
+    total_points = db.session.query(db.func.coalesce(db.func.sum(User.points), 0)).scalar()
+    new_points_today = stats.metric_total(StatsMetric.PROBLEMS_CREATED, day_from=today, day_to=today)
     
     return render_template('admin.html',
                          users=users,
+                         users_cursor=users_cursor,
                          problems=problems,
                          points=problems, # Для совместимости с разными шаблонами
+                         problems_cursor=problems_cursor,
                          complaints=complaints,
+                         complaints_cursor=complaints_cursor,
+                         pending_complaints=pending_query.count(),
                          tasks=tasks,
-                         total_users=len(users),
+                         total_users=User.query.count(),
                          total_points=total_points,
-                         total_tasks=len(tasks),
+                         total_tasks=tasks_query.count(),
+                         total_problems=Problem.query.count(),
+                         completed_problems=Problem.query.filter_by(status=ProblemStatus.COMPLETED).count(),
                          new_points_today=new_points_today)
 
 @app.route('/admin/profile')
@@ -86,14 +199,21 @@ def admin_panel():
 @admin_required
 def admin_profile_view():
     """Отдельная страница управления для админа (из admin_profile.html)"""
-    users = User.query.all()
-    problems = Problem.query.all()
-    complaints = Complaint.query.filter_by(status=ComplaintStatus.PENDING).all()
+    users, _ = keyset_page(User.query, User, request)
+    problems, _ = keyset_page(Problem.query.filter(Problem.status != ProblemStatus.COMPLETED), Problem, request)
+    pending_query = (Complaint.query.options(joinedload(Complaint.problem), joinedload(Complaint.user))
+                     .filter_by(status=ComplaintStatus.PENDING))
+    complaints, complaints_cursor = keyset_page(pending_query, Complaint, request)
     
     return render_template('admin_profile.html',
                          users=users,
                          problems=problems,
-                         complaints=complaints)
+                         complaints=complaints,
+                         complaints_cursor=complaints_cursor,
+                         pending_complaints=pending_query.count(),
+                         total_users=User.query.count(),
+                         total_problems=Problem.query.count(),
+                         completed_problems=Problem.query.filter_by(status=ProblemStatus.COMPLETED).count())
 
 @app.route('/profile')
 @login_required
@@ -103,14 +223,10 @@ def profile():
     # Выполненные мной задания
     my_completed = Problem.query.filter_by(assigned_to=current_user.id, status=ProblemStatus.COMPLETED).order_by(Problem.completed_at.desc()).all()
     
-    # Расчет рейтинга
-    all_users = User.query.order_by(User.points.desc()).all()
-    user_rank = next((i + 1 for i, u in enumerate(all_users) if u.id == current_user.id), 0)
-    
     return render_template('profile.html', 
                          my_reports=my_reports, 
                          my_completed=my_completed,
-                         user_rank=user_rank)
+                         user_rank=leaderboards.rank_in('all', current_user.id) or user_rank(current_user))
 
 @app.route('/dashboard')
 @login_required
@@ -143,15 +259,16 @@ def tasks():
 def completed_tasks():
     """Страница выполненных заданий с фотоотчетами"""
     # Все завершенные проблемы с отчетами
-    completed = Problem.query.filter_by(status=ProblemStatus.COMPLETED).all()
+    # (отчеты и исполнители подгружаются вместе с проблемами, без запроса на каждую)
+    completed = (Problem.query.options(joinedload(Problem.task_completion), joinedload(Problem.worker))
+                 .filter_by(status=ProblemStatus.COMPLETED).all())
     
     # Собираем отчеты
     reports = []
     for problem in completed:
-        report = TaskCompletion.query.filter_by(problem_id=problem.id).first()
         reports.append({
             'problem': problem,
-            'report': report,
+            'report': problem.task_completion,
             'user': problem.worker if problem.assigned_to else None
         })
     
@@ -160,8 +277,30 @@ def completed_tasks():
 @app.route('/rating')
 @login_required
 def rating():
-    users = User.query.order_by(User.points.desc()).limit(50).all()
-    return render_template('rating.html', users=users)
+    # scope: all - за все время, week - за последние 7 дней, city - по городу пользователя
+    scope = request.args.get('scope', 'all')
+    if scope == 'city':
+        users = leaderboards.get(f'city:{current_user.city}')
+    elif scope == 'week':
+        users = leaderboards.get('week')
+    else:
+        scope = 'all'
+        users = leaderboards.get('all')
+    my_rank = next((u['rank'] for u in users if u['id'] == current_user.id), None)
+    if my_rank is None and scope == 'all':
+        my_rank = user_rank(current_user)
+    return render_template('rating.html', users=users, scope=scope, my_rank=my_rank)
+
+@app.route('/api/leaderboard', methods=['GET'])
+@login_required
+def get_leaderboard():
+    """Таблица лидеров: scope=all|week|city (city - параметр city или город пользователя)"""
+    scope = request.args.get('scope', 'all')
+    if scope == 'city':
+        scope = f"city:{request.args.get('city') or current_user.city}"
+    elif scope not in ('all', 'week'):
+        return json_response('error', {}, 'scope: all, week или city', 400)
+    return json_response('success', {'scope': scope, 'users': leaderboards.get(scope)})
 
 @app.route('/shop')
 @login_required
@@ -184,38 +323,79 @@ def education():
 @app.route('/analytics')
 @login_required
 def analytics():
-    problems = Problem.query.all()
-    users = User.query.all()
-    
-    total_points = len(problems)
-    active_points = len([p for p in problems if p.status != ProblemStatus.COMPLETED])
-    completed_points = len([p for p in problems if p.status == ProblemStatus.COMPLETED])
-    
-    active_users = sorted(users, key=lambda u: u.total_reports, reverse=True)[:5]
-    
-    categories = {}
-    for p in problems:
-        categories[p.category] = categories.get(p.category, 0) + 1
-        
-    priorities = {
-        'Критический': len([p for p in problems if p.severity >= 5]),
-        'Высокий': len([p for p in problems if p.severity == 4]),
-        'Средний': len([p for p in problems if p.severity == 3]),
-        'Низкий': len([p for p in problems if p.severity <= 2])
-    }
+    # Итоги - из ежедневной сводки, распределение по важности - агрегатом по таблице проблем
+    total_points = stats.metric_total(StatsMetric.PROBLEMS_CREATED)
+    completed_points = stats.metric_total(StatsMetric.PROBLEMS_COMPLETED)
 
     # Берем город из конфига или дефолтный
     city_name = app.config.get('CITY_NAME', ConfigDefaults.CITY_NAME)
 
+    # Точки для карты загружаются отдельно: /api/analytics/points
     return render_template('analytics.html',
                          city_name=city_name,
                          total_points=total_points,
-                         active_points=active_points,
+                         active_points=total_points - completed_points,
                          completed_points=completed_points,
-                         active_users=active_users,
-                         categories=categories,
-                         priorities=priorities,
-                         points=problems)
+                         active_users=top_reporters(5),
+                         categories=stats.metric_by_category(StatsMetric.PROBLEMS_CREATED),
+                         priorities=severity_breakdown())
+
+@app.route('/api/analytics/points', methods=['GET'])
+@login_required
+def get_analytics_points():
+    """Проблемы для карты аналитики: bbox=west,south,east,north (или lat, lng, zoom), limit"""
+    bbox, zoom = viewport_from_request(request)
+    limit = request.args.get('limit', MAX_ANALYTICS_POINTS, type=int)
+    return jsonify(analytics_points(bbox, max(1, limit)))
+
+@app.route('/api/analytics/heatmap', methods=['GET'])
+@login_required
+def get_analytics_heatmap():
+    """
+    Тепловая карта: проблемы, сгруппированные в ячейки сетки.
+    Параметры: bbox (или lat, lng, zoom), step - шаг сетки в градусах,
+    category, date_from, date_to. Ответ кэшируется до следующего изменения проблем.
+    """
+    bbox, zoom = viewport_from_request(request)
+    step = heatmap_step(bbox, request.args.get('step', type=float))
+    bbox = snap_bbox(bbox, step)
+    category = request.args.get('category') or None
+    key = ('heatmap', step, bbox, category,
+           request.args.get('date_from'), request.args.get('date_to'))
+    
+    def build():
+        query = filter_date_range(Problem.query, Problem.created_at, request)
+        return encode_json(heatmap_grid(query, bbox, step, category))
+    
+    etag, body, _ = marker_snapshot.get(key, build)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/analytics/timeseries', methods=['GET'])
+@login_required
+def get_analytics_timeseries():
+    """
+    Временные ряды: bucket=hour|day|week, date_from, date_to (включительно),
+    metrics=reported,completed,complaints,orders (по умолчанию - все).
+    """
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in BUCKET_SIZES:
+        return json_response('error', {}, 'bucket: hour, day или week', 400)
+    metrics = [m for m in request.args.get('metrics', 'reported,completed,complaints,orders').split(',') if m]
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        return json_response('error', {}, f'Неизвестные показатели: {", ".join(unknown)}', 400)
+    
+    date_to_raw = request.args.get('date_to')
+    date_to = parse_date(date_to_raw)
+    if date_to and len(date_to_raw) <= 10:
+        date_to = date_to + timedelta(days=1) - timedelta(microseconds=1)
+    start, end = bucket_range(bucket, parse_date(request.args.get('date_from')), date_to)
+    return jsonify(time_series(bucket, start, end, metrics))
 
 # ==========================================
 # АВТОРИЗАЦИЯ
@@ -261,14 +441,17 @@ def register():
         
         # Проверяем реферальный код из формы
         ref_code = request.form.get('ref_code')
-        if ref_code:
-            referrer = User.query.filter_by(referral_code=ref_code).first()
-            if referrer:
-                user.referred_by = referrer.id
-                referrer.referral_points += 50  # Награда за приглашение
-                referrer.points += 50
+        referrer = User.query.filter_by(referral_code=ref_code).first() if ref_code else None
+        if referrer:
+            user.referred_by = referrer.id
+            referrer.referral_points += ConfigDefaults.REFERRAL_POINTS
         
         db.session.add(user)
+        if referrer:
+            # Награда за приглашение
+            db.session.flush()
+            award_points(referrer, ConfigDefaults.REFERRAL_POINTS, PointsReason.REFERRAL, user.id)
+            fire_achievements(referrer, AchievementEvent.POINTS_CHANGED)
         db.session.commit()
         
         login_user(user)
@@ -289,26 +472,20 @@ def logout():
 @app.route('/api/problems', methods=['GET'])
 @login_required
 def get_problems_api():
-    """Получение списка активных проблем для карты"""
-    # Показываем только не завершенные, или все (зависит от логики, тут все кроме скрытых)
-    problems = Problem.query.filter(Problem.status != ProblemStatus.COMPLETED).all()
-    result = []
-    for p in problems:
-        result.append({
-            'id': p.id,
-            'lat': p.lat,
-            'lng': p.lng,
-            'title': p.title,
-            'description': p.description,
-            'category': p.category,
-            'severity': p.severity,
-            'reward': p.reward,
-            'status': p.status,
-            'photo': p.photo, # URL фото
-            'likes': p.likes,
-            'dislikes': p.dislikes
-        })
-    return jsonify(result)
+    """
+    Получение списка активных проблем для карты.
+    Параметры bbox=west,south,east,north (или lat, lng, zoom) ограничивают выборку видимой областью,
+    cluster=1 включает кластеризацию на мелких масштабах, since=<курсор> - дельта-синхронизацию,
+    format=columnar|binary - компактный формат маркеров.
+    """
+    return map_response()
+
+@app.route('/api/problems/<int:problem_id>', methods=['GET'])
+@login_required
+def get_problem_details(problem_id: int):
+    """Полные данные проблемы (для маркеров, загруженных в компактном формате)"""
+    problem = Problem.query.get_or_404(problem_id)
+    return jsonify(problem_details(problem))
 
 @app.route('/api/problems/add', methods=['POST'])
 @login_required
@@ -322,6 +499,14 @@ def add_problem():
         category = request.form.get('category', ProblemCategory.OTHER)
         severity = int(request.form.get('severity', ProblemSeverity.MEDIUM))
         
+        # Похожие заявки рядом: предлагаем поддержать существующую (force=1 - создать все равно)
+        if not request.form.get('force'):
+            radius = app.config.get('DUPLICATE_RADIUS_M', ConfigDefaults.DUPLICATE_RADIUS_M)
+            candidates = find_nearby(lat, lng, radius, category=category)
+            if candidates:
+                return json_response('duplicate', {'candidates': candidates},
+                                     'Рядом уже есть похожая проблема', 409)
+        
         # Обработка файла с использованием новой утилиты
         photo_path = save_uploaded_file(request.files.get('photo'), prefix='prob')
         
@@ -339,21 +524,46 @@ def add_problem():
         
         # Начисляем опыт и баллы создателю
         points_to_add = app.config.get('POINTS_FOR_POINT', ConfigDefaults.POINTS_FOR_POINT)
-        current_user.points += points_to_add
         current_user.total_reports += 1
         current_user.experience += 30
         
-        # Проверяем достижения
-        current_user.check_achievements()
+        stats.record_problem_created(problem, current_user)
         
         db.session.add(problem)
+        db.session.flush()
+        award_points(current_user, points_to_add, PointsReason.REPORT, problem.id)
+        challenges.record(current_user, 'reports')
+        
+        # Проверяем достижения
+        fire_achievements(current_user, AchievementEvent.PROBLEM_REPORTED, AchievementEvent.POINTS_CHANGED)
+        
         db.session.commit()
+        problems_changed(problem)
+        event_hub.publish('problem_created', marker_dict(problem))
         
         return json_response('success', {'id': problem.id}, 'Проблема добавлена')
     except Exception as e:
         app.logger.error(f"Error adding problem: {e}")
         return json_response('error', {}, f'Ошибка при добавлении: {str(e)}', 500)
 
+@app.route('/api/problems/nearby', methods=['GET'])
+@login_required
+def get_nearby_problems():
+    """Незавершенные проблемы рядом с точкой (lat, lng, radius в метрах, category, limit)"""
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+    except (KeyError, ValueError):
+        return json_response('error', {}, 'Не указаны координаты', 400)
+    
+    default_radius = app.config.get('DUPLICATE_RADIUS_M', ConfigDefaults.DUPLICATE_RADIUS_M)
+    radius = min(max(request.args.get('radius', default_radius, type=float), 1), 5000)
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 50)
+    
+    return json_response('success', {
+        'problems': find_nearby(lat, lng, radius, category=request.args.get('category'), limit=limit)
+    })
+
 @app.route('/api/problems/<int:problem_id>/take', methods=['POST'])
 @login_required
 def take_problem(problem_id: int):
@@ -366,6 +576,8 @@ def take_problem(problem_id: int):
     problem.assigned_to = current_user.id
     problem.status = ProblemStatus.IN_PROGRESS
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     return json_response('success', {}, 'Задание принято')
 
 @app.route('/api/problems/<int:problem_id>/cancel', methods=['POST'])
@@ -383,6 +595,8 @@ def cancel_problem(problem_id: int):
     problem.assigned_to = None
     problem.status = ProblemStatus.REPORTED
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     
     return json_response('success', {}, 'Задание отменено')
 
@@ -403,14 +617,19 @@ def complete_problem(problem_id: int):
     problem.completed_at = datetime.utcnow()
     
     # Начисляем награду тому, кто выполнил (или текущему юзеру, если он закрыл)
-    current_user.points += problem.reward
     current_user.total_completed += 1
     current_user.experience += 50
     
+    stats.record_problem_completed(problem)
+    award_points(current_user, problem.reward, PointsReason.COMPLETION, problem.id)
+    challenges.record(current_user, 'completions')
+    
     # Проверяем достижения
-    current_user.check_achievements()
+    fire_achievements(current_user, AchievementEvent.TASK_COMPLETED, AchievementEvent.POINTS_CHANGED)
     
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     return json_response('success', {'reward': problem.reward}, 'Задание выполнено')
 
 @app.route('/api/problems/complete_with_photos', methods=['POST'])
@@ -445,15 +664,20 @@ def complete_problem_with_photos():
         problem.completed_at = datetime.utcnow()
         
         # Начисляем награду
-        current_user.points += problem.reward
         current_user.total_completed += 1
         current_user.experience += 50
         
+        stats.record_problem_completed(problem)
+        award_points(current_user, problem.reward, PointsReason.COMPLETION, problem.id)
+        challenges.record(current_user, 'completions')
+        
         # Проверяем достижения
-        current_user.check_achievements()
+        fire_achievements(current_user, AchievementEvent.TASK_COMPLETED, AchievementEvent.POINTS_CHANGED)
         
         db.session.add(completion)
         db.session.commit()
+        problems_changed(problem)
+        publish_problem_status(problem)
         
         return json_response('success', {'reward': problem.reward}, 'Задание выполнено с фотоотчетом')
         
@@ -471,53 +695,29 @@ def vote_problem(problem_id: int):
         
     vote_type = data.get('type')  # 'like' или 'dislike'
     
-    if vote_type not in ['like', 'dislike']:
+    if vote_type not in votes.VOTE_TYPES:
         return json_response('error', {}, 'Неверный тип голоса', 400)
     
-    # Проверяем, не голосовал ли уже пользователь
-    existing_vote = Vote.query.filter_by(
-        problem_id=problem_id,
-        user_id=current_user.id
-    ).first()
-    
     problem = Problem.query.get_or_404(problem_id)
     
-    if existing_vote:
-        # Если повторный голос того же типа - удаляем
-        if existing_vote.vote_type == vote_type:
-            db.session.delete(existing_vote)
-            if vote_type == 'like':
-                problem.likes -= 1
-            else:
-                problem.dislikes -= 1
-        else:
-            # Если меняем голос - обновляем
-            if existing_vote.vote_type == 'like':
-                problem.likes -= 1
-                problem.dislikes += 1
-            else:
-                problem.dislikes -= 1
-                problem.likes += 1
-            existing_vote.vote_type = vote_type
-    else:
-        # Новый голос
-        vote = Vote(
-            problem_id=problem_id,
-            user_id=current_user.id,
-            vote_type=vote_type
-        )
-        db.session.add(vote)
-        
-        if vote_type == 'like':
-            problem.likes += 1
-        else:
-            problem.dislikes += 1
+    # Строка Vote и атомарное приращение счетчиков (или в буфер, см. votes.py)
+    # toggle=false - поставить голос, не снимая уже поставленный (поддержка заявки-дубликата)
+    old_vote, new_vote = votes.cast_vote(current_user.id, problem_id, vote_type,
+                                         toggle=data.get('toggle', True) is not False)
+    if old_vote is None and new_vote is not None:
+        challenges.record(current_user, 'votes')
     
     db.session.commit()
+    likes, dislikes = votes.counts([problem_id])[problem_id]
+    if not votes.vote_buffer.enabled:
+        # При буферизации кэши сбрасываются и событие публикуется после записи пачки
+        problems_changed(problem)
+        event_hub.publish('votes_changed', {'id': problem_id, 'likes': likes, 'dislikes': dislikes})
     
     return json_response('success', {
-        'likes': problem.likes,
-        'dislikes': problem.dislikes
+        'likes': likes,
+        'dislikes': dislikes,
+        'user_vote': new_vote
     }, 'Голос учтен')
 
 @app.route('/api/problems/<int:problem_id>/vote_status')
@@ -529,12 +729,13 @@ def get_vote_status(problem_id: int):
         user_id=current_user.id
     ).first()
     
-    problem = Problem.query.get_or_404(problem_id)
+    Problem.query.get_or_404(problem_id)
+    likes, dislikes = votes.counts([problem_id])[problem_id]
     
     return json_response('success', {
         'user_vote': vote.vote_type if vote else None,
-        'likes': problem.likes,
-        'dislikes': problem.dislikes
+        'likes': likes,
+        'dislikes': dislikes
     })
 
 @app.route('/api/problems/<int:problem_id>/delete', methods=['POST'])
@@ -544,14 +745,21 @@ def delete_problem(problem_id: int):
     """Удаление проблемы (Админ)"""
     problem = Problem.query.get_or_404(problem_id)
     
+    stat_days = problem_stat_days([problem.id])
+    
     # Удаляем связанные жалобы, если есть
     Complaint.query.filter_by(problem_id=problem.id).delete()
     Comment.query.filter_by(problem_id=problem.id).delete()
     Vote.query.filter_by(problem_id=problem.id).delete()
     TaskCompletion.query.filter_by(problem_id=problem.id).delete()
     
+    record_deletions([problem.id])
     db.session.delete(problem)
+    stats.rebuild_days(stat_days)
     db.session.commit()
+    timeseries_cache.invalidate_days(stat_days)
+    problems_changed(problem)
+    event_hub.publish('problem_deleted', {'ids': [problem_id]})
     return json_response('success', {}, 'Проблема удалена')
 
 @app.route('/api/comments/add', methods=['POST'])
@@ -568,6 +776,7 @@ def add_comment():
         text=data.get('text')
     )
     db.session.add(comment)
+    challenges.record(current_user, 'comments')
     db.session.commit()
     return json_response('success', {}, 'Комментарий добавлен')
 
@@ -575,7 +784,8 @@ def add_comment():
 @login_required
 def get_comments(problem_id: int):
     """Получить комментарии к проблеме"""
-    comments = Comment.query.filter_by(problem_id=problem_id).order_by(Comment.created_at.asc()).all()
+    comments = (Comment.query.options(joinedload(Comment.user))
+                .filter_by(problem_id=problem_id).order_by(Comment.created_at.asc()).all())
     comments_data = [{
         'id': c.id,
         'user': c.user.username,
@@ -602,7 +812,13 @@ def add_complaint():
         status=ComplaintStatus.PENDING
     )
     db.session.add(complaint)
+    stats.record_complaint(complaint, current_user, db.session.get(Problem, complaint.problem_id))
     db.session.commit()
+    event_hub.publish('complaint_filed', {
+        'id': complaint.id,
+        'problem_id': complaint.problem_id,
+        'reason': complaint.reason
+    }, admin_only=True)
     return json_response('success', {}, 'Жалоба отправлена')
 
 @app.route('/api/user/<int:user_id>/toggle_admin', methods=['POST'])
@@ -630,15 +846,27 @@ def delete_user(user_id: int):
         return json_response('error', {}, 'Нельзя удалить себя', 400)
     
     # Удаляем связанные данные
+    deleted_ids = [pid for (pid,) in db.session.query(Problem.id).filter_by(user_id=user.id)]
+    stat_days = problem_stat_days(deleted_ids)
+    for model in (Complaint, Order):
+        stat_days.update(d.date() for (d,) in db.session.query(model.created_at).filter_by(user_id=user.id) if d)
+    record_deletions(deleted_ids)
     Problem.query.filter_by(user_id=user.id).delete()
     Complaint.query.filter_by(user_id=user.id).delete()
     Comment.query.filter_by(user_id=user.id).delete()
     Vote.query.filter_by(user_id=user.id).delete()
     TaskCompletion.query.filter_by(user_id=user.id).delete()
     Order.query.filter_by(user_id=user.id).delete()
+    PointsTransaction.query.filter_by(user_id=user.id).delete()
     
     db.session.delete(user)
+    stats.rebuild_days(stat_days)
     db.session.commit()
+    timeseries_cache.invalidate_days(stat_days)
+    leaderboards.clear()
+    problems_changed(everything=True)
+    if deleted_ids:
+        event_hub.publish('problem_deleted', {'ids': deleted_ids})
     
     return json_response('success', {}, 'Пользователь удален')
 
@@ -667,7 +895,8 @@ def edit_user(user_id: int):
         return json_response('error', {}, 'Нет данных', 400)
     
     if 'points' in data:
-        user.points = int(data['points'])
+        set_balance(user, int(data['points']), PointsReason.ADMIN)
+        fire_achievements(user, AchievementEvent.POINTS_CHANGED)
     if 'is_worker' in data:
         user.is_worker = bool(data['is_worker'])
     if 'city' in data:
@@ -695,10 +924,23 @@ def edit_problem(problem_id: int):
         problem.severity = int(data['severity'])
     if 'reward' in data:
         problem.reward = int(data['reward'])
+    stat_days = []
     if 'status' in data and data['status'] in ProblemStatus.ALL:
+        was_completed = problem.status == ProblemStatus.COMPLETED
         problem.status = data['status']
+        problem.is_completed = problem.status == ProblemStatus.COMPLETED
+        if problem.is_completed and problem.completed_at is None:
+            # Без даты выполнения проблема не попала бы в сводку выполненных за день
+            problem.completed_at = datetime.utcnow()
+        if was_completed != problem.is_completed and problem.completed_at:
+            db.session.flush()
+            stat_days = [problem.completed_at.date()]
+            stats.rebuild_days(stat_days)
     
     db.session.commit()
+    timeseries_cache.invalidate_days(stat_days)
+    problems_changed(problem)
+    event_hub.publish('problem_updated', marker_dict(problem))
     return json_response('success', {}, 'Проблема обновлена')
 
 @app.route('/api/tasks/create', methods=['POST'])
@@ -725,10 +967,26 @@ def create_task():
     )
     
     db.session.add(task)
+    stats.record_problem_created(task, current_user)
     db.session.commit()
+    problems_changed(task)
+    event_hub.publish('problem_created', marker_dict(task))
     
     return json_response('success', {'id': task.id}, 'Задача создана')
 
+@app.route('/api/user/<int:user_id>/rank', methods=['GET'])
+@login_required
+def get_user_rank(user_id: int):
+    """Место пользователя в рейтинге и соседи по рейтингу (radius выше и ниже, до 10)"""
+    user = User.query.get_or_404(user_id)
+    radius = max(0, min(10, request.args.get('radius', 2, type=int)))
+    neighbours = users_around(user, radius)
+    rank = next(r for r, u in neighbours if u.id == user.id)
+    return json_response('success', {
+        'rank': rank,
+        'around': [rank_entry(r, u) for r, u in neighbours]
+    })
+
 @app.route('/api/user/update_balance', methods=['POST'])
 @login_required
 def update_balance():
@@ -738,7 +996,8 @@ def update_balance():
         return json_response('error', {}, 'Нет данных', 400)
         
     amount = int(data.get('amount', 0))
-    current_user.points += amount
+    award_points(current_user, amount, PointsReason.BALANCE)
+    fire_achievements(current_user, AchievementEvent.POINTS_CHANGED)
     db.session.commit()
     return json_response('success', {'new_balance': current_user.points}, 'Баланс обновлен')
 
@@ -746,8 +1005,18 @@ def update_balance():
 @login_required
 @admin_required
 def get_orders():
-    """Получить заказы (только для админа)"""
-    orders = Order.query.order_by(Order.created_at.desc()).all()
+    """
+    Получить заказы (только для админа).
+    Постранично (limit, cursor - следующий курсор в заголовке X-Next-Cursor),
+    фильтры: status, user_id, date_from, date_to.
+    """
+    query = Order.query.options(joinedload(Order.user))
+    if request.args.get('status'):
+        query = query.filter(Order.status == request.args['status'])
+    if request.args.get('user_id', type=int):
+        query = query.filter(Order.user_id == request.args.get('user_id', type=int))
+    query = filter_date_range(query, Order.created_at, request)
+    orders, next_cursor = keyset_page(query, Order, request)
     orders_data = []
     
     for order in orders:
@@ -765,7 +1034,10 @@ def get_orders():
             'total': order.price * order.quantity
         })
     
-    return jsonify(orders_data)
+    response = jsonify(orders_data)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
     
 @app.route('/api/orders/create', methods=['POST'])
 @login_required
@@ -776,10 +1048,7 @@ def create_order():
         if not data:
             return json_response('error', {}, 'Нет данных', 400)
         
-        # Проверяем баланс
         item_price = int(data.get('price', 0))
-        if current_user.points < item_price:
-            return json_response('error', {}, 'Недостаточно средств', 400)
         
         # Создаем заказ
         order = Order(
@@ -795,18 +1064,18 @@ def create_order():
             status=OrderStatus.PENDING
         )
         
-        # Списание баллов
-        current_user.points -= item_price
+        db.session.add(order)
+        db.session.flush()
         
-        # Проверяем достижения для заказа
-        orders_count = Order.query.filter_by(user_id=current_user.id).count()
-        if orders_count == 0:  # Если это первый заказ (перед добавлением нового заказа)
-            current_user.add_badge('Первый заказ', 'fa-shopping-bag')
+        # Проверка баланса и списание баллов - одним UPDATE
+        if not spend_points(current_user, item_price, PointsReason.ORDER, order.id):
+            db.session.rollback()
+            return json_response('error', {}, 'Недостаточно средств', 400)
+        stats.record_order(current_user)
         
-        # Проверяем другие достижения
-        current_user.check_achievements()
+        # Проверяем достижения для заказа
+        fire_achievements(current_user, AchievementEvent.ORDER_CREATED)
         
-        db.session.add(order)
         db.session.commit()
         
         return json_response('success', {'order_id': order.id}, 'Заказ создан')
@@ -840,27 +1109,16 @@ def update_order_status(order_id: int):
 @login_required
 def get_daily_challenge():
     """Получить текущий ежедневный челлендж"""
-    today = datetime.utcnow().date()
-    today_problems = Problem.query.filter(
-        Problem.user_id == current_user.id,
-        db.func.date(Problem.created_at) == today
-    ).count()
-    
-    challenges = [
-        {'id': 1, 'name': 'Первая проблема', 'target': 1, 'reward': 10},
-        {'id': 2, 'name': 'Три проблемы за день', 'target': 3, 'reward': 30},
-        {'id': 3, 'name': 'Помочь с 5 заданиями', 'target': 5, 'reward': 50},
-    ]
-    
-    completed = []
-    for challenge in challenges:
-        if today_problems >= challenge['target']:
-            completed.append(challenge['id'])
+    # Счетчики за сегодня - одна строка по ключу (пользователь, день), каталог - из кэша
+    progress = challenges.progress(current_user)
+    catalog = challenges.catalog()
+    completed = [c['id'] for c in catalog if progress.get(c['metric'], 0) >= c['target']]
     
     return json_response('success', {
-        'challenges': challenges,
+        'challenges': catalog,
         'completed': completed,
-        'today_problems': today_problems
+        'progress': progress,
+        'today_problems': progress['reports']
     })
     
 @app.route('/api/problems/<int:problem_id>/assign', methods=['POST'])
@@ -884,6 +1142,8 @@ def assign_problem(problem_id: int):
     problem.status = ProblemStatus.ASSIGNED
     
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     
     return json_response('success', {}, 'Задача закреплена за вами')
     
@@ -905,6 +1165,8 @@ def unassign_problem(problem_id: int):
     problem.status = ProblemStatus.REPORTED
     
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     
     return json_response('success', {}, 'Задача отменена')
 
@@ -948,15 +1210,20 @@ def complete_with_report(problem_id: int):
     problem.completed_by = current_user.id
     
     # Начисляем баллы исполнителю
-    current_user.points += problem.reward
     current_user.total_completed += 1
     current_user.experience += 50
     
+    stats.record_problem_completed(problem)
+    award_points(current_user, problem.reward, PointsReason.COMPLETION, problem.id)
+    challenges.record(current_user, 'completions')
+    
     # Проверяем достижения
-    current_user.check_achievements()
+    fire_achievements(current_user, AchievementEvent.TASK_COMPLETED, AchievementEvent.POINTS_CHANGED)
     
     db.session.add(completion)
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     
     return json_response('success', {
         'reward': problem.reward,
@@ -983,14 +1250,19 @@ def complete_simple(problem_id: int):
     problem.completed_by = current_user.id
     
     # Начисляем баллы исполнителю
-    current_user.points += problem.reward
     current_user.total_completed += 1
     current_user.experience += 50
     
+    stats.record_problem_completed(problem)
+    award_points(current_user, problem.reward, PointsReason.COMPLETION, problem.id)
+    challenges.record(current_user, 'completions')
+    
     # Проверяем достижения
-    current_user.check_achievements()
+    fire_achievements(current_user, AchievementEvent.TASK_COMPLETED, AchievementEvent.POINTS_CHANGED)
     
     db.session.commit()
+    problems_changed(problem)
+    publish_problem_status(problem)
     
     return json_response('success', {
         'reward': problem.reward,
@@ -1009,6 +1281,35 @@ def get_problem_status(problem_id: int):
         'completed_by': problem.completed_by
     })
 
+@app.route('/api/problems/state', methods=['GET'])
+@login_required
+def get_problems_state():
+    """
+    Состояние сразу нескольких проблем: ?ids=1,2,3 (не больше MAX_STATE_IDS).
+    Статус, исполнитель, счетчики голосов и голос текущего пользователя - для
+    предзагрузки всей видимой области одним запросом.
+    """
+    ids = parse_id_list(request.args.get('ids'))
+    if not ids:
+        return json_response('error', {}, 'Не указаны id проблем', 400)
+    if len(ids) > MAX_STATE_IDS:
+        return json_response('error', {}, f'Не больше {MAX_STATE_IDS} проблем за запрос', 400)
+    states = problem_states(ids, current_user.id)
+    return json_response('success', {'problems': {str(pid): state for pid, state in states.items()}})
+
+@app.route('/api/stream')
+@login_required
+def event_stream():
+    """
+    Поток событий (Server-Sent Events): problem_created, problem_updated,
+    problem_status_changed, problem_deleted, votes_changed, а для админов
+    также complaint_filed и complaint_resolved
+    """
+    sub = event_hub.subscribe(is_admin=current_user.is_admin,
+                              last_event_id=request.headers.get('Last-Event-ID'))
+    return Response(event_hub.stream(sub), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ==========================================
 # API ДЛЯ ЖАЛОБ (МОДЕРАЦИЯ)
 # ==========================================
@@ -1017,58 +1318,125 @@ def get_problem_status(problem_id: int):
 @login_required
 @admin_required
 def get_all_complaints():
-    """Получить список всех жалоб для админки"""
-    complaints = Complaint.query.order_by(Complaint.created_at.desc()).all()
-    
-    complaints_data = []
-    for complaint in complaints:
-        complaints_data.append({
-            'id': complaint.id,
-            'problem_id': complaint.problem_id,
-            'problem_title': complaint.problem.title if complaint.problem else 'Проблема удалена',
-            'problem_status': complaint.problem.status if complaint.problem else '',
-            'problem_user': complaint.problem.user.username if complaint.problem and complaint.problem.user else '',
-            'reason': complaint.reason,
-            'reason_text': get_reason_text(complaint.reason),
-            'description': complaint.description,
-            'status': complaint.status,
-            'status_text': get_status_text(complaint.status),
-            'user': complaint.user.username if complaint.user else 'Аноним',
-            'user_id': complaint.user_id,
-            'created_at': complaint.created_at.strftime('%d.%m.%Y %H:%M'),
-            'resolved_at': complaint.resolved_at.strftime('%d.%m.%Y %H:%M') if complaint.resolved_at else None,
-            'resolved_by': complaint.admin.username if complaint.admin else None,
-            'admin_comment': complaint.admin_comment
-        })
+    """
+    Получить список жалоб для админки.
+    Постранично (limit, cursor - следующий курсор в заголовке X-Next-Cursor),
+    фильтры: status, reason, user_id, date_from, date_to.
+    """
+    query = Complaint.query.options(
+        joinedload(Complaint.problem).joinedload(Problem.user),
+        joinedload(Complaint.user),
+        joinedload(Complaint.admin)
+    )
+    if request.args.get('status'):
+        query = query.filter(Complaint.status == request.args['status'])
+    if request.args.get('reason'):
+        query = query.filter(Complaint.reason == request.args['reason'])
+    if request.args.get('user_id', type=int):
+        query = query.filter(Complaint.user_id == request.args.get('user_id', type=int))
+    query = filter_date_range(query, Complaint.created_at, request)
+    complaints, next_cursor = keyset_page(query, Complaint, request)
+    response = jsonify([complaint_details(c) for c in complaints])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/complaints/<int:complaint_id>', methods=['GET'])
+@login_required
+@admin_required
+def get_complaint(complaint_id: int):
+    """Детали одной жалобы (для просмотра из любой страницы списка)"""
+    complaint = Complaint.query.get_or_404(complaint_id)
+    return jsonify(complaint_details(complaint))
+
+@app.route('/api/admin/users', methods=['GET'])
+@login_required
+@admin_required
+def get_admin_users():
+    """
+    Пользователи для админки постранично (limit, cursor).
+    Фильтры: q (начало имени), city, role (admin/worker), date_from, date_to.
+    """
+    query = User.query
+    if request.args.get('q'):
+        query = query.filter(User.username.startswith(request.args['q']))
+    if request.args.get('city'):
+        query = query.filter(User.city == request.args['city'])
+    if request.args.get('role') == 'admin':
+        query = query.filter(User.is_admin.is_(True))
+    elif request.args.get('role') == 'worker':
+        query = query.filter(User.is_worker.is_(True))
+    query = filter_date_range(query, User.created_at, request)
+    users, next_cursor = keyset_page(query, User, request)
     
-    return jsonify(complaints_data)
+    return json_response('success', {
+        'items': [{
+            'id': u.id,
+            'username': u.username,
+            'email': u.email,
+            'city': u.city,
+            'points': u.points,
+            'level': u.level,
+            'is_admin': u.is_admin,
+            'is_worker': u.is_worker,
+            'created_at': u.created_at.strftime('%d.%m.%Y') if u.created_at else ''
+        } for u in users],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/admin/problems', methods=['GET'])
+@login_required
+@admin_required
+def get_admin_problems():
+    """
+    Проблемы для админки постранично (limit, cursor).
+    Фильтры: status, category, user_id, assigned_to, date_from, date_to.
+    """
+    query = Problem.query.options(joinedload(Problem.user))
+    for arg, column in (('status', Problem.status), ('category', Problem.category)):
+        if request.args.get(arg):
+            query = query.filter(column == request.args[arg])
+    for arg, column in (('user_id', Problem.user_id), ('assigned_to', Problem.assigned_to)):
+        if request.args.get(arg, type=int):
+            query = query.filter(column == request.args.get(arg, type=int))
+    query = filter_date_range(query, Problem.created_at, request)
+    problems, next_cursor = keyset_page(query, Problem, request)
+    
+    return json_response('success', {
+        'items': [{
+            'id': p.id,
+            'title': p.title,
+            'description': p.description or '',
+            'category': p.category,
+            'severity': p.severity,
+            'status': p.status,
+            'user': p.user.username if p.user else '',
+            'assigned_to': p.assigned_to,
+            'created_at': p.created_at.strftime('%d.%m.%Y') if p.created_at else ''
+        } for p in problems],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/api/complaints/stats', methods=['GET'])
 @login_required
 @admin_required
 def get_complaints_stats():
     """Получить статистику по жалобам"""
-    total = Complaint.query.count()
-    pending = Complaint.query.filter_by(status=ComplaintStatus.PENDING).count()
-    resolved = Complaint.query.filter_by(status=ComplaintStatus.RESOLVED).count()
-    rejected = Complaint.query.filter_by(status=ComplaintStatus.REJECTED).count()
+    by_status = dict(db.session.query(Complaint.status, db.func.count(Complaint.id))
+                     .group_by(Complaint.status).all())
     
-    # Статистика по причинам за последние 30 дней
+    # Статистика по причинам за последние 30 дней - из ежедневной сводки
     from datetime import datetime, timedelta
-    month_ago = datetime.utcnow() - timedelta(days=30)
-    recent_complaints = Complaint.query.filter(Complaint.created_at >= month_ago).all()
-    
-    reasons = {}
-    for c in recent_complaints:
-        reasons[c.reason] = reasons.get(c.reason, 0) + 1
+    month_ago = (datetime.utcnow() - timedelta(days=30)).date()
+    reasons = stats.complaint_reasons(month_ago)
     
     return jsonify({
-        'total': total,
-        'pending': pending,
-        'resolved': resolved,
-        'rejected': rejected,
+        'total': sum(by_status.values()),
+        'pending': by_status.get(ComplaintStatus.PENDING, 0),
+        'resolved': by_status.get(ComplaintStatus.RESOLVED, 0),
+        'rejected': by_status.get(ComplaintStatus.REJECTED, 0),
         'reasons': reasons,
-        'recent_total': len(recent_complaints)
+        'recent_total': sum(reasons.values())
     })
 
 @app.route('/api/problems/refresh', methods=['GET'])
@@ -1087,24 +1455,7 @@ def refresh_problems():
 def refresh_map_markers():
     """Обновить маркеры на карте после удаления проблем"""
     try:
-        problems = Problem.query.filter(Problem.status != ProblemStatus.COMPLETED).all()
-        result = []
-        for p in problems:
-            result.append({
-                'id': p.id,
-                'lat': p.lat,
-                'lng': p.lng,
-                'title': p.title,
-                'description': p.description,
-                'category': p.category,
-                'severity': p.severity,
-                'reward': p.reward,
-                'status': p.status,
-                'photo': p.photo,
-                'likes': p.likes,
-                'dislikes': p.dislikes
-            })
-        return jsonify(result)
+        return map_response()
     except Exception as e:
         app.logger.error(f"Error refreshing map markers: {e}")
         return json_response('error', {}, 'Ошибка обновления карты', 500)
@@ -1128,6 +1479,7 @@ def resolve_complaint(complaint_id):
             return json_response('error', {}, 'Жалоба уже обработана', 400)
         
         # Выполняем выбранное действие
+        deleted_problem = None
         if action == 'delete_problem':
             if complaint.problem:
                 # Удаляем проблему и связанные данные
@@ -1135,10 +1487,12 @@ def resolve_complaint(complaint_id):
                 
                 # Наказываем автора проблемы (отнимаем баллы)
                 if problem.user:
-                    problem.user.points = max(0, problem.user.points - problem.reward)
+                    deduct_up_to(problem.user, problem.reward or 0, PointsReason.PENALTY, problem.id)
                     problem.user.total_reports = max(0, problem.user.total_reports - 1)
                     db.session.add(problem.user)
                 
+                stat_days = problem_stat_days([problem.id])
+                
                 # Удаляем связанные записи
                 Comment.query.filter_by(problem_id=problem.id).delete()
                 Vote.query.filter_by(problem_id=problem.id).delete()
@@ -1148,7 +1502,10 @@ def resolve_complaint(complaint_id):
                 Complaint.query.filter_by(problem_id=problem.id).delete()
                 
                 # Теперь удаляем саму проблему
+                record_deletions([problem.id])
                 db.session.delete(problem)
+                stats.rebuild_days(stat_days)
+                deleted_problem, deleted_problem_id = problem, problem.id
                 action_taken = 'problem_deleted'
                 
         elif action == 'reject':
@@ -1170,6 +1527,11 @@ def resolve_complaint(complaint_id):
         complaint.admin_comment = admin_comment
         
         db.session.commit()
+        event_hub.publish('complaint_resolved', {'id': complaint_id, 'status': ComplaintStatus.RESOLVED}, admin_only=True)
+        if deleted_problem:
+            timeseries_cache.invalidate_days(stat_days)
+            problems_changed(deleted_problem)
+            event_hub.publish('problem_deleted', {'ids': [deleted_problem_id]})
         
         return json_response('success', {}, 'Жалоба успешно обработана')
         
@@ -1195,6 +1557,7 @@ def reject_complaint_admin(complaint_id):
         complaint.action_taken = 'complaint_rejected'
         
         db.session.commit()
+        event_hub.publish('complaint_resolved', {'id': complaint_id, 'status': ComplaintStatus.REJECTED}, admin_only=True)
         
         return json_response('success', {}, 'Жалоба отклонена')
         
@@ -1211,7 +1574,11 @@ def delete_complaint_admin(complaint_id):
         complaint = Complaint.query.get_or_404(complaint_id)
         
         db.session.delete(complaint)
+        stat_days = [complaint.created_at.date()] if complaint.created_at else []
+        stats.rebuild_days(stat_days)
         db.session.commit()
+        timeseries_cache.invalidate_days(stat_days)
+        event_hub.publish('complaint_resolved', {'id': complaint_id, 'status': 'deleted'}, admin_only=True)
         
         return json_response('success', {}, 'Жалоба удалена')
         
@@ -1220,6 +1587,27 @@ def delete_complaint_admin(complaint_id):
         return json_response('error', {}, f'Ошибка: {str(e)}', 500)
 
 # Вспомогательные функции
+def complaint_details(complaint):
+    """Жалоба в формате API модерации"""
+    return {
+        'id': complaint.id,
+        'problem_id': complaint.problem_id,
+        'problem_title': complaint.problem.title if complaint.problem else 'Проблема удалена',
+        'problem_status': complaint.problem.status if complaint.problem else '',
+        'problem_user': complaint.problem.user.username if complaint.problem and complaint.problem.user else '',
+        'reason': complaint.reason,
+        'reason_text': get_reason_text(complaint.reason),
+        'description': complaint.description,
+        'status': complaint.status,
+        'status_text': get_status_text(complaint.status),
+        'user': complaint.user.username if complaint.user else 'Аноним',
+        'user_id': complaint.user_id,
+        'created_at': complaint.created_at.strftime('%d.%m.%Y %H:%M'),
+        'resolved_at': complaint.resolved_at.strftime('%d.%m.%Y %H:%M') if complaint.resolved_at else None,
+        'resolved_by': complaint.admin.username if complaint.admin else None,
+        'admin_comment': complaint.admin_comment
+    }
+
 def get_reason_text(reason):
     """Получить русское название причины"""
     reasons = {
@@ -1247,80 +1635,17 @@ def get_status_text(status):
 @app.route('/api/sensors', methods=['GET'])
 def get_sensors():
     """
-    Получает данные о погоде и загрязнении воздуха для указанных координат.
-    Если API ключ невалиден или лимит исчерпан, возвращает мок-данные.
+    Получает данные о погоде и загрязнении воздуха для указанных координат
+    (кэш по ячейкам сетки, см. sensors.py).
+    Если API недоступен, возвращает последние удачные показания или мок-данные
+    с пометкой stale (без ожидания таймаутов, пока провайдер отключен автоматом).
     """
     # Получаем координаты из GET параметров или берем дефолтные
     lat, lng = get_coordinates_from_request(request)
     
-    api_key = app.config.get('OPENWEATHER_API_KEY')
-    sensors = []
+    sensor_data = sensors.get_sensor_data(lat, lng)
     
-    try:
-        # Проверяем, задан ли ключ (не заглушка)
-        if api_key and api_key != 'ВАШ_API_KEY_ЗДЕСЬ':
-            # 1. Запрос погоды
-            weather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lng}&appid={api_key}&units=metric"
-            w_res = requests.get(weather_url, timeout=3)
-            
-            # 2. Запрос загрязнения (AQI)
-            air_url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lng}&appid={api_key}"
-            a_res = requests.get(air_url, timeout=3)
-            
-            if w_res.status_code == 200:
-                w_data = w_res.json()
-                # Создаем виртуальный датчик температуры
-                sensors.append({
-                    'sensor_id': 'TEMP-MAIN',
-                    'sensor_type': 'temperature',
-                    'value': w_data['main']['temp'],
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'lat': lat + 0.002, # Слегка смещаем для отображения на карте
-                    'lng': lng + 0.002
-                })
-                # Виртуальный датчик влажности
-                sensors.append({
-                    'sensor_id': 'HUM-MAIN',
-                    'sensor_type': 'soil_moisture', # Используем как влажность почвы/воздуха
-                    'value': w_data['main']['humidity'],
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'lat': lat - 0.002,
-                    'lng': lng + 0.001
-                })
-                
-            if a_res.status_code == 200:
-                a_data = a_res.json()
-                aqi = a_data['list'][0]['main']['aqi'] # 1 (хорошо) - 5 (плохо)
-                # Переводим в "индекс чистоты" (100 - отлично, 0 - ужасно)
-                purity_index = 100 - ((aqi - 1) * 25)
-                sensors.append({
-                    'sensor_id': 'AIR-QA',
-                    'sensor_type': 'soil_moisture', # Реюзинг типа для графика
-                    'value': purity_index,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'lat': lat + 0.001,
-                    'lng': lng - 0.003
-                })
-                
-        else:
-            raise Exception("API Key not configured")
-            
-    except Exception as e:
-        app.logger.warning(f"Sensor API Error (using mocks): {e}")
-        # MOCK DATA (Генерация случайных значений, если API не работает)
-        for i in range(1, 6):
-            val = random.uniform(15, 30) if i % 2 == 0 else random.uniform(40, 80)
-            stype = 'temperature' if i % 2 == 0 else 'soil_moisture'
-            sensors.append({
-                'sensor_id': f'SENS-{i:03d}',
-                'sensor_type': stype,
-                'value': round(val, 1),
-                'timestamp': datetime.utcnow().isoformat(),
-                'lat': lat + random.uniform(-0.02, 0.02),
-                'lng': lng + random.uniform(-0.02, 0.02)
-            })
-    
-    return jsonify(sensors)
+    return jsonify(sensor_data)
     
 # ==========================================
 # ИНИЦИАЛИЗАЦИЯ
@@ -1332,6 +1657,9 @@ def init_db():
         # Создаем таблицы
         db.create_all()
         
+        # Применяем миграции схемы к уже существующей базе
+        run_migrations(app.logger)
+        
         # Создаем админа, если нет
         if not User.query.filter_by(username='admin').first():
             app.logger.info("Создаем учетную запись администратора (admin / admin123)...")
@@ -1372,10 +1700,56 @@ def init_db():
                 status=ProblemStatus.REPORTED
             )
             db.session.add(p1)
-            
+        
+        challenges.seed_defaults()
+        
+        # Начальные балансы новых пользователей - в журнал баллов
+        # (расхождения у существующих не скрываем: см. flask reconcile-points)
+        db.session.flush()
+        points.open_balances()
+        
         db.session.commit()
         app.logger.info("База данных готова. Все таблицы созданы.")
 
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Пересчитать ежедневную сводку из исходных таблиц (периодическая компактизация)"""
+    rows = stats.rebuild()
+    db.session.commit()
+    print(f"Ежедневная сводка пересчитана: {rows} строк")
+
+@app.cli.command('rebuild-votes')
+def rebuild_votes_command():
+    """Пересчитать счетчики лайков/дизлайков проблем из таблицы голосов"""
+    votes.rebuild_counts()
+    db.session.commit()
+    problems_changed()
+    print("Счетчики голосов пересчитаны")
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Проверить через EXPLAIN QUERY PLAN, что частые запросы используют индексы"""
+    failures = check_query_plans()
+    for name, indexes, plan in failures:
+        print(f"[!] {name}: ожидался индекс {' или '.join(indexes)}, план: {plan}")
+    if failures:
+        raise SystemExit(1)
+    print("Все частые запросы используют индексы")
+
+@app.cli.command('reconcile-points')
+@click.option('--fix', is_flag=True, help='Записать в журнал корректировки на разницу')
+def reconcile_points_command(fix):
+    """Сверить балансы пользователей с журналом баллов"""
+    rows = points.discrepancies()
+    for user_id, balance, total in rows:
+        print(f"Пользователь {user_id}: баланс {balance}, по журналу {total}")
+    if fix and rows:
+        points.reconcile()
+        db.session.commit()
+        print(f"Исправлено: {len(rows)}")
+    elif not rows:
+        print("Расхождений нет")
+
 if __name__ == '__main__':
     init_db()
     app.run(debug=True, port=5000)
@@ -0,0 +1,66 @@
+"""
+Ежедневные челленджи.
+
+Прогресс пользователя за день хранится счетчиками в DailyProgress
+(ключ - пользователь и день) и увеличивается в роутах вместе с действием,
+поэтому проверка челленджей - одно чтение по первичному ключу.
+Каталог челленджей - таблица Challenge, кэшируется в памяти процесса.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+from models import db, User, DailyProgress, Challenge
+from stats import upsert_increment
+
+METRICS = ('reports', 'completions', 'votes', 'comments')
+
+CATALOG_TTL = 300
+
+# Челленджи по умолчанию (создаются при первом запуске)
+DEFAULT_CHALLENGES = [
+    {'id': 1, 'name': 'Первая проблема', 'metric': 'reports', 'target': 1, 'reward': 10},
+    {'id': 2, 'name': 'Три проблемы за день', 'metric': 'reports', 'target': 3, 'reward': 30},
+    {'id': 3, 'name': 'Помочь с 5 заданиями', 'metric': 'completions', 'target': 5, 'reward': 50},
+]
+
+_catalog: Optional[List[dict]] = None
+_catalog_loaded_at = 0.0
+_catalog_lock = threading.Lock()
+
+
+def record(user: User, metric: str) -> None:
+    """Увеличить счетчик действия пользователя за сегодня (вызывать до commit)"""
+    upsert_increment(DailyProgress, {'user_id': user.id, 'day': datetime.utcnow().date()}, metric, 1)
+
+
+def progress(user: User) -> dict:
+    """Счетчики пользователя за сегодня"""
+    row = db.session.get(DailyProgress, (user.id, datetime.utcnow().date()))
+    return {metric: (getattr(row, metric) or 0) if row else 0 for metric in METRICS}
+
+
+def catalog() -> List[dict]:
+    """Активные челленджи (из кэша, не старше CATALOG_TTL секунд)"""
+    global _catalog, _catalog_loaded_at
+    with _catalog_lock:
+        if _catalog is not None and time.monotonic() - _catalog_loaded_at < CATALOG_TTL:
+            return _catalog
+    items = [{'id': c.id, 'name': c.name, 'metric': c.metric, 'target': c.target, 'reward': c.reward}
+             for c in Challenge.query.filter_by(is_active=True).order_by(Challenge.id)]
+    with _catalog_lock:
+        _catalog, _catalog_loaded_at = items, time.monotonic()
+    return items
+
+
+def invalidate_catalog() -> None:
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+
+def seed_defaults() -> None:
+    """Создать челленджи по умолчанию, если каталог пуст"""
+    if Challenge.query.first() is None:
+        db.session.add_all([Challenge(**c) for c in DEFAULT_CHALLENGES])
+        invalidate_catalog()
@@ -0,0 +1,137 @@
+"""
+Серверная кластеризация маркеров по уровням масштаба с кэшем по ячейкам
+"""
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+from models import Problem
+from markers import open_problems_query
+from geo import BBox
+
+# Размер ячейки кластера в пикселях экрана (при тайлах 256px)
+CLUSTER_CELL_PX = 80
+# Сколько ячеек хранить на один уровень масштаба
+MAX_CACHED_CELLS_PER_ZOOM = 20000
+# Сколько ячеек можно перебрать за один запрос; для большей области масштаб понижается
+MAX_CLUSTER_CELLS = 4096
+
+Cell = Tuple[int, int]
+
+
+def cell_size(zoom: int) -> float:
+    """Размер ячейки кластера в градусах для уровня масштаба"""
+    return CLUSTER_CELL_PX * 360.0 / (256 * 2 ** zoom)
+
+
+def cell_of(lat: float, lng: float, zoom: int) -> Cell:
+    size = cell_size(zoom)
+    return int(math.floor((lat + 90) / size)), int(math.floor((lng + 180) / size))
+
+
+def cells_in_bbox(bbox: BBox, zoom: int) -> int:
+    """Число ячеек кластеров, покрывающих bbox на уровне zoom"""
+    south, west, north, east = bbox
+    row_from, col_from = cell_of(south, west, zoom)
+    row_to, col_to = cell_of(north, east, zoom)
+    return (row_to - row_from + 1) * (col_to - col_from + 1)
+
+
+def cluster_zoom(bbox: BBox, zoom: int, max_zoom: int) -> int:
+    """Уровень кластеризации: не выше max_zoom и такой, чтобы bbox укладывался в MAX_CLUSTER_CELLS ячеек"""
+    zoom = max(0, min(zoom, max_zoom))
+    while zoom > 0 and cells_in_bbox(bbox, zoom) > MAX_CLUSTER_CELLS:
+        zoom -= 1
+    return zoom
+
+
+def cell_bbox(cells: List[Cell], zoom: int) -> BBox:
+    """bbox, покрывающий набор ячеек"""
+    size = cell_size(zoom)
+    rows = [c[0] for c in cells]
+    cols = [c[1] for c in cells]
+    return (min(rows) * size - 90, min(cols) * size - 180,
+            (max(rows) + 1) * size - 90, (max(cols) + 1) * size - 180)
+
+
+def _aggregate(points: List[tuple]) -> dict:
+    """Кластер из списка (id, lat, lng, category, severity)"""
+    count = len(points)
+    cluster = {
+        'lat': sum(p[1] for p in points) / count,
+        'lng': sum(p[2] for p in points) / count,
+        'count': count,
+        'category': Counter(p[3] for p in points).most_common(1)[0][0],
+        'severity': max(p[4] or 0 for p in points)
+    }
+    if count == 1:
+        cluster['id'] = points[0][0]
+    return cluster
+
+
+class ClusterCache:
+    """
+    Кэш кластеров: для каждого уровня масштаба хранит агрегат по ячейке
+    (None - в ячейке нет проблем). При изменении проблемы сбрасываются только
+    ячейки, содержащие ее координаты, на всех уровнях.
+    """
+
+    def __init__(self, max_zoom: int = 14, max_cells: int = MAX_CACHED_CELLS_PER_ZOOM):
+        self.max_zoom = max_zoom
+        self.max_cells = max_cells
+        self._cells: Dict[int, OrderedDict] = {}
+        self._lock = threading.Lock()
+
+    def get_clusters(self, bbox: BBox, zoom: int) -> List[dict]:
+        """Кластеры в bbox (zoom заранее приводится через cluster_zoom)"""
+        zoom = cluster_zoom(bbox, zoom, self.max_zoom)
+        south, west, north, east = bbox
+        row_from, col_from = cell_of(south, west, zoom)
+        row_to, col_to = cell_of(north, east, zoom)
+        wanted = [(r, c) for r in range(row_from, row_to + 1) for c in range(col_from, col_to + 1)]
+
+        result: Dict[Cell, Optional[dict]] = {}
+        missing = []
+        with self._lock:
+            level = self._cells.setdefault(zoom, OrderedDict())
+            for cell in wanted:
+                if cell in level:
+                    level.move_to_end(cell)
+                    result[cell] = level[cell]
+                else:
+                    missing.append(cell)
+
+        if missing:
+            computed = self._compute(missing, zoom)
+            with self._lock:
+                level = self._cells.setdefault(zoom, OrderedDict())
+                for cell in missing:
+                    level[cell] = result[cell] = computed.get(cell)
+                while len(level) > self.max_cells:
+                    level.popitem(last=False)
+
+        return [cluster for cluster in result.values() if cluster]
+
+    def _compute(self, cells: List[Cell], zoom: int) -> Dict[Cell, dict]:
+        wanted = set(cells)
+        query = open_problems_query(cell_bbox(cells, zoom)).with_entities(
+            Problem.id, Problem.lat, Problem.lng, Problem.category, Problem.severity)
+        grouped: Dict[Cell, list] = {}
+        for row in query:
+            cell = cell_of(row.lat, row.lng, zoom)
+            if cell in wanted:
+                grouped.setdefault(cell, []).append(tuple(row))
+        return {cell: _aggregate(points) for cell, points in grouped.items()}
+
+    def invalidate_point(self, lat: float, lng: float) -> None:
+        """Сбросить ячейки, содержащие точку, на всех уровнях масштаба"""
+        with self._lock:
+            for zoom, level in self._cells.items():
+                level.pop(cell_of(lat, lng, zoom), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cells.clear()
+
+
+cluster_cache = ClusterCache()
@@ -24,12 +24,42 @@ class Config:
     # Если ключ не указан, сайт будет работать в демо-режиме (случайные данные).
     OPENWEATHER_API_KEY = '849eb3b74706b1536b82a112883337d3'
     
+    # --- КЭШ ДАТЧИКОВ ---
+    # Координаты округляются до сетки с таким шагом (в градусах, 0.05 - около 5 км):
+    # все запросы из одной ячейки получают одни и те же показания
+    SENSOR_GRID_STEP = 0.05
+    # Сколько секунд показания ячейки считаются свежими (OpenWeatherMap обновляет данные ~10 минут)
+    SENSOR_CACHE_TTL = 600
+    # Максимальное число ячеек в кэше
+    SENSOR_CACHE_SIZE = 1000
+    # Общий срок (в секундах) на параллельные запросы погоды и загрязнения воздуха
+    SENSOR_DEADLINE = 3.0
+    # На сколько секунд прекращать запросы к провайдеру после серии ошибок
+    SENSOR_BREAKER_COOLDOWN = 30
+    
     # --- НАСТРОЙКИ ГОРОДА ПО УМОЛЧАНИЮ ---
     # Эти координаты используются, если пользователь не выбрал другой город
     # Координаты Киселевска
     CITY_NAME = 'Киселевск'
     CITY_CENTER = [53.9925, 86.6669]
     
+    # --- КАРТА ---
+    # До этого уровня масштаба включительно карта получает кластеры вместо отдельных маркеров
+    MAP_CLUSTER_MAX_ZOOM = 14
+    # Радиус (в метрах), в котором новая заявка той же категории считается возможным дубликатом
+    DUPLICATE_RADIUS_M = 50
+    
+    # --- ГОЛОСА ---
+    # Копить лайки/дизлайки в памяти и записывать пачкой (для очень популярных проблем).
+    # Только для одного процесса: буфер не общий между воркерами.
+    VOTE_BUFFERING = False
+    # Как часто (в секундах) записывать накопленные голоса
+    VOTE_FLUSH_INTERVAL = 1.0
+    
+    # --- ОТЛАДКА ---
+    # Предупреждение в логе, если запрос к сайту выполнил больше SQL-запросов (0 - отключить)
+    QUERY_COUNT_WARN = 30
+    
     # --- ГЕЙМИФИКАЦИЯ ---
     # Количество баллов, начисляемых за действия
     POINTS_FOR_POINT = 15      # За создание заявки
@@ -70,6 +70,9 @@ class ProblemCategory:
         WATER: 'Вода',
         ANIMALS: 'Животные'
     }
+    
+    # Порядок кодов категорий в компактном формате маркеров (не менять, только дописывать)
+    CODES = [OTHER, POLLUTION, PLANTS, DAMAGE, WATER, ANIMALS]
 
 
 class OrderStatus:
@@ -106,11 +109,54 @@ class ComplaintStatus:
     REJECTED = 'rejected'
 
 
+class PointsReason:
+    """Причины операций в журнале баллов"""
+    REPORT = 'report'          # Новая заявка
+    COMPLETION = 'completion'  # Выполненное задание
+    REFERRAL = 'referral'      # Приглашенный пользователь
+    ORDER = 'order'            # Заказ в магазине
+    BALANCE = 'balance'        # Изменение баланса через API
+    PENALTY = 'penalty'        # Штраф (удаление проблемы по жалобе)
+    ADMIN = 'admin'            # Правка администратором
+    RECONCILE = 'reconcile'    # Сверка журнала с балансом
+
+    # Не считаются заработанными баллами (рейтинг за неделю)
+    NOT_EARNED = [RECONCILE, ADMIN]
+
+
+class StatsMetric:
+    """Показатели ежедневной сводки (DailyStats)"""
+    PROBLEMS_CREATED = 'problems_created'
+    PROBLEMS_COMPLETED = 'problems_completed'
+    ORDERS = 'orders'
+    POINTS_ISSUED = 'points_issued'
+    
+    # Жалобы считаются отдельно по причинам: 'complaint:spam', 'complaint:fake', ...
+    COMPLAINT_PREFIX = 'complaint:'
+    COMPLAINT_REASONS = ['spam', 'fake', 'offensive', 'duplicate', 'other']
+    
+    @classmethod
+    def complaint(cls, reason: str) -> str:
+        if reason not in cls.COMPLAINT_REASONS:
+            reason = 'other'
+        return cls.COMPLAINT_PREFIX + reason
+
+
 class ConfigDefaults:
     """Значения по умолчанию из конфигурации"""
     POINTS_FOR_POINT = 15
     CITY_NAME = 'Киселевск'
     CITY_CENTER = [53.9925, 86.6669]  # Киселевск
+    MAP_CLUSTER_MAX_ZOOM = 14
+    DUPLICATE_RADIUS_M = 50
+    REFERRAL_POINTS = 50
+    VOTE_BUFFERING = False
+    VOTE_FLUSH_INTERVAL = 1.0
+    SENSOR_GRID_STEP = 0.05
+    SENSOR_CACHE_TTL = 600
+    SENSOR_CACHE_SIZE = 1000
+    SENSOR_DEADLINE = 3.0
+    SENSOR_BREAKER_COOLDOWN = 30
     
 class ProblemStatus:
     """Статусы проблем"""
@@ -0,0 +1,102 @@
+"""
+Живые обновления через Server-Sent Events: внутрипроцессный хаб рассылки событий
+"""
+import json
+import queue
+import threading
+from collections import deque
+from typing import Iterator, Optional
+
+# Интервал служебных пингов, чтобы прокси не закрывали неактивное соединение
+HEARTBEAT_SECONDS = 15
+
+
+class Subscription:
+    """Подписчик потока: собственная ограниченная очередь событий"""
+
+    def __init__(self, is_admin: bool, max_queue: int):
+        self.is_admin = is_admin
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lagging = False  # Очередь переполнилась - клиенту нужна полная перезагрузка
+
+
+class EventHub:
+    """
+    Рассылка типизированных событий всем подписчикам /api/stream.
+    publish() не блокируется: медленный подписчик с переполненной очередью
+    получает событие resync вместо потерянных событий.
+    Последние события хранятся для продолжения потока по заголовку Last-Event-ID.
+    """
+
+    def __init__(self, max_queue: int = 100, history: int = 200):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._history = deque(maxlen=history)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, is_admin: bool = False, last_event_id: Optional[str] = None) -> Subscription:
+        sub = Subscription(is_admin, self.max_queue)
+        with self._lock:
+            if last_event_id is not None:
+                try:
+                    last_seen = int(last_event_id)
+                except ValueError:
+                    last_seen = None
+                oldest = self._history[0][0] if self._history else self._last_id + 1
+                if last_seen is None or last_seen + 1 < oldest:
+                    sub.lagging = True  # Пропущенные события уже не хранятся
+                else:
+                    missed = [event for event in self._history
+                              if event[0] > last_seen and (sub.is_admin or not event[3])]
+                    if len(missed) > self.max_queue:
+                        sub.lagging = True  # Пропущено больше, чем вмещает очередь
+                    else:
+                        for event in missed:
+                            sub.queue.put_nowait(event)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, event_type: str, data: dict, admin_only: bool = False) -> None:
+        """Отправить событие (вызывать после commit)"""
+        with self._lock:
+            self._last_id += 1
+            event = (self._last_id, event_type, json.dumps(data, ensure_ascii=False), admin_only)
+            self._history.append(event)
+            for sub in self._subscribers:
+                if admin_only and not sub.is_admin:
+                    continue
+                try:
+                    sub.queue.put_nowait(event)
+                except queue.Full:
+                    sub.lagging = True
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def stream(self, sub: Subscription) -> Iterator[str]:
+        """Генератор текста text/event-stream для подписчика"""
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                if sub.lagging:
+                    sub.lagging = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    yield f'id: {self._last_id}\nevent: resync\ndata: {{}}\n\n'
+                try:
+                    event_id, event_type, payload, _ = sub.queue.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                yield f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+        finally:
+            self.unsubscribe(sub)
+
+
+event_hub = EventHub()
@@ -0,0 +1,119 @@
+"""
+Геометрия карты: сетка пространственного индекса, bbox и расстояния
+"""
+import math
+from typing import Optional, Tuple, List
+
+# Шаг сетки пространственного индекса в градусах (~1 км по широте)
+GRID_STEP = 0.01
+GRID_COLS = int(round(360 / GRID_STEP))
+GRID_ROWS = int(round(180 / GRID_STEP))
+
+# Если bbox захватывает больше строк сетки, чем это значение,
+# запрос по ячейкам теряет смысл и используется обычный фильтр по координатам
+MAX_GRID_ROWS_IN_QUERY = 60
+
+# Размер окна карты (в пикселях), используемый для оценки bbox по zoom
+DEFAULT_VIEWPORT_PX = (1280, 800)
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE_LAT = 111320.0
+
+BBox = Tuple[float, float, float, float]  # (south, west, north, east)
+
+
+def _row(lat: float) -> int:
+    return min(GRID_ROWS - 1, max(0, int(math.floor((lat + 90) / GRID_STEP))))
+
+
+def _col(lng: float) -> int:
+    return min(GRID_COLS - 1, max(0, int(math.floor((lng + 180) / GRID_STEP))))
+
+
+def cell_for(lat: float, lng: float) -> int:
+    """
+    Номер ячейки сетки для точки (строка * число столбцов + столбец)
+    """
+    return _row(lat) * GRID_COLS + _col(lng)
+
+
+def cell_ranges(bbox: BBox) -> Optional[List[Tuple[int, int]]]:
+    """
+    Диапазоны номеров ячеек, покрывающих bbox (по одному на строку сетки).
+    Возвращает None, если bbox слишком большой для запроса по ячейкам.
+    """
+    south, west, north, east = bbox
+    row_from, row_to = _row(south), _row(north)
+    if row_to - row_from + 1 > MAX_GRID_ROWS_IN_QUERY:
+        return None
+    col_from, col_to = _col(west), _col(east)
+    return [(row * GRID_COLS + col_from, row * GRID_COLS + col_to)
+            for row in range(row_from, row_to + 1)]
+
+
+def parse_bbox(value: Optional[str]) -> Optional[BBox]:
+    """
+    Разбирает bbox в формате Leaflet toBBoxString(): "west,south,east,north"
+    """
+    if not value:
+        return None
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except (ValueError, TypeError):
+        return None
+    south, north = max(-90.0, min(south, north)), min(90.0, max(south, north))
+    west, east = max(-180.0, min(west, east)), min(180.0, max(west, east))
+    return south, west, north, east
+
+
+def parse_zoom(value: Optional[str]) -> Optional[int]:
+    """Уровень масштаба карты (0-22) или None"""
+    try:
+        return max(0, min(22, int(value)))
+    except (ValueError, TypeError):
+        return None
+
+
+def bbox_from_zoom(lat: float, lng: float, zoom: int,
+                   viewport_px: Tuple[int, int] = DEFAULT_VIEWPORT_PX) -> BBox:
+    """
+    Примерный bbox окна карты по центру и уровню масштаба (Web Mercator, тайлы 256px)
+    """
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_lng = viewport_px[0] * deg_per_px / 2
+    half_lat = viewport_px[1] * deg_per_px * math.cos(math.radians(lat)) / 2
+    return (max(-90.0, lat - half_lat), max(-180.0, lng - half_lng),
+            min(90.0, lat + half_lat), min(180.0, lng + half_lng))
+
+
+def viewport_from_request(request) -> Tuple[Optional[BBox], Optional[int]]:
+    """
+    Получает область карты из запроса: bbox=west,south,east,north и/или lat, lng, zoom
+    """
+    zoom = parse_zoom(request.args.get('zoom'))
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None and zoom is not None:
+        try:
+            lat = float(request.args['lat'])
+            lng = float(request.args['lng'])
+            bbox = bbox_from_zoom(lat, lng, zoom)
+        except (KeyError, ValueError, TypeError):
+            bbox = None
+    return bbox, zoom
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Расстояние между точками в метрах (формула гаверсинусов)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def bbox_around(lat: float, lng: float, radius_m: float) -> BBox:
+    """bbox, описанный вокруг круга радиусом radius_m"""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    dlng = radius_m / (METERS_PER_DEGREE_LAT * max(0.01, math.cos(math.radians(lat))))
+    return (max(-90.0, lat - dlat), max(-180.0, lng - dlng),
+            min(90.0, lat + dlat), min(180.0, lng + dlng))
@@ -0,0 +1,249 @@
+"""
+Рейтинг пользователей по баллам.
+
+Место пользователя считается индексированным COUNT по User.points (индекс ix_user_points),
+а не выборкой и перебором всей таблицы. Порядок рейтинга: баллы по убыванию,
+при равенстве - кто раньше зарегистрировался (меньший id).
+
+Таблицы лидеров (за все время, за 7 дней, по городу) хранятся готовыми снимками
+и обновляются инкрементально после commit, изменившего баллы (недельный рейтинг -
+по журналу PointsTransaction);
+раз в LEADERBOARD_TTL секунд снимок пересчитывается из БД целиком.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.orm import Session
+from models import db, User, PointsTransaction
+from constants import PointsReason
+
+LEADERBOARD_SIZE = 50
+LEADERBOARD_TTL = 300
+WEEKLY_WINDOW = timedelta(days=7)
+
+
+def _ahead_of(user: User):
+    """Условие "пользователь стоит в рейтинге выше user" """
+    points = user.points or 0
+    return or_(User.points > points, and_(User.points == points, User.id < user.id))
+
+
+def _behind(user: User):
+    points = user.points or 0
+    return or_(User.points < points, and_(User.points == points, User.id > user.id))
+
+
+def user_rank(user: User) -> int:
+    """Место пользователя в общем рейтинге (с 1)"""
+    return db.session.query(db.func.count(User.id)).filter(_ahead_of(user)).scalar() + 1
+
+
+def users_around(user: User, radius: int = 2) -> List[Tuple[int, User]]:
+    """
+    Соседи пользователя по рейтингу: до radius человек выше и ниже (включая его самого).
+    Возвращает [(место, пользователь), ...] по возрастанию места.
+    """
+    rank = user_rank(user)
+    above = (User.query.filter(_ahead_of(user))
+             .order_by(User.points.asc(), User.id.desc()).limit(radius).all())
+    below = (User.query.filter(_behind(user))
+             .order_by(User.points.desc(), User.id.asc()).limit(radius).all())
+    above.reverse()
+    first = rank - len(above)
+    return [(first + i, u) for i, u in enumerate(above + [user] + below)]
+
+
+def user_entry(user: User) -> dict:
+    """Данные пользователя для строки рейтинга"""
+    return {
+        'id': user.id,
+        'username': user.username,
+        'avatar': user.avatar,
+        'city': user.city,
+        'points': user.points or 0,
+        'level': user.level,
+        'is_admin': user.is_admin,
+        'is_worker': user.is_worker,
+        'total_reports': user.total_reports or 0,
+        'total_completed': user.total_completed or 0
+    }
+
+
+def rank_entry(rank: int, user: User) -> dict:
+    return {'rank': rank, **user_entry(user)}
+
+
+# --- Таблицы лидеров ---
+
+def weekly_scores(since: datetime) -> Dict[int, int]:
+    """Баллы, заработанные с момента since, по журналу (траты и сверки не учитываются)"""
+    rows = (db.session.query(PointsTransaction.user_id, func.sum(PointsTransaction.delta))
+            .filter(PointsTransaction.created_at >= since, PointsTransaction.delta > 0,
+                    PointsTransaction.reason.notin_(PointsReason.NOT_EARNED))
+            .group_by(PointsTransaction.user_id))
+    return {user_id: score for user_id, score in rows if score}
+
+
+class Leaderboards:
+    """
+    Снимки таблиц лидеров по областям: 'all', 'week', 'city:<город>'.
+    Для 'all' и городов хранится top-N по текущим баллам, для 'week' - баллы
+    всех активных за неделю (top-N выбирается при чтении).
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE, ttl: float = LEADERBOARD_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._boards: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _build(self, scope: str) -> dict:
+        if scope == 'week':
+            scores = weekly_scores(datetime.utcnow() - WEEKLY_WINDOW)
+            return {'scores': scores, 'entries': {}, 'exact': True, 'ranked': None}
+        query = User.query
+        if scope.startswith('city:'):
+            query = query.filter(User.city == scope[len('city:'):])
+        users = query.order_by(User.points.desc(), User.id.asc()).limit(self.size).all()
+        entries = {u.id: user_entry(u) for u in users}
+        return {'scores': {uid: e['points'] for uid, e in entries.items()}, 'entries': entries,
+                'exact': len(users) < self.size, 'ranked': None}
+
+    def get(self, scope: str) -> List[dict]:
+        """Top-N области: [{'rank', 'id', 'username', ..., 'points'}], points - баллы в этой области"""
+        with self._lock:
+            board = self._boards.get(scope)
+            fresh = (board is not None and not board['stale']
+                     and time.monotonic() - board['built_at'] < self.ttl)
+            if fresh:
+                if board['ranked'] is not None:
+                    return board['ranked']
+                version = board['version']
+                scores, entries = dict(board['scores']), dict(board['entries'])
+
+        if not fresh:
+            board = self._build(scope)
+            board.update(built_at=time.monotonic(), version=0, stale=False)
+            scores, entries = board['scores'], board['entries']
+
+        top = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:self.size]
+        missing = [uid for uid, _ in top if uid not in entries]
+        if missing:
+            for user in User.query.filter(User.id.in_(missing)):
+                entries[user.id] = user_entry(user)
+        ranked = [dict(entries[uid], rank=i + 1, points=score)
+                  for i, (uid, score) in enumerate(top) if uid in entries]
+
+        with self._lock:
+            if not fresh:
+                board['ranked'] = ranked
+                self._boards[scope] = board
+            elif self._boards.get(scope) is board and board['version'] == version:
+                # Снимок не менялся, пока считали порядок
+                board['entries'].update(entries)
+                board['ranked'] = ranked
+        return ranked
+
+    def rank_in(self, scope: str, user_id: int) -> Optional[int]:
+        """Место пользователя по готовому снимку (без пересчета) или None"""
+        with self._lock:
+            board = self._boards.get(scope)
+            ranked = board.get('ranked') if board else None
+        if ranked:
+            return next((e['rank'] for e in ranked if e['id'] == user_id), None)
+        return None
+
+    def points_changed(self, entry: dict, earned: int) -> None:
+        """
+        Инкрементальное обновление снимков после изменения баллов пользователя.
+        earned - заработанные баллы (без правок администратора и сверок), идут в недельный рейтинг.
+        """
+        with self._lock:
+            for scope in ('all', f"city:{entry['city']}"):
+                board = self._boards.get(scope)
+                if board is not None:
+                    self._update_top(board, entry)
+            board = self._boards.get('week')
+            if board is not None and earned > 0:
+                board['scores'][entry['id']] = board['scores'].get(entry['id'], 0) + earned
+                board['entries'][entry['id']] = entry
+                board['ranked'] = None
+                board['version'] += 1
+
+    def _update_top(self, board: dict, entry: dict) -> None:
+        scores, uid, score = board['scores'], entry['id'], entry['points']
+        lowest = min(scores.values()) if scores else 0
+        if uid in scores:
+            # Если участник опустился ниже всех, его место мог занять кто-то вне снимка
+            if score < lowest and not board['exact']:
+                board['stale'] = True
+        elif len(scores) >= self.size and score <= lowest:
+            return
+        scores[uid] = score
+        board['entries'][uid] = entry
+        if len(scores) > self.size:
+            drop = min(scores, key=lambda k: (scores[k], -k))
+            del scores[drop]
+            board['entries'].pop(drop, None)
+            board['exact'] = False
+        board['ranked'] = None
+        board['version'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._boards.clear()
+
+
+leaderboards = Leaderboards()
+
+
+# Изменения баллов копятся в session.info и применяются к снимкам после commit
+
+def note_points_change(user: User, delta: int, reason: Optional[str] = None) -> None:
+    """
+    Запомнить изменение баллов пользователя до commit (вызывается из points.py).
+    В недельный рейтинг, как и в weekly_scores(), идут только заработанные баллы:
+    положительные операции журнала с причиной не из PointsReason.NOT_EARNED.
+    """
+    if delta:
+        earned = delta if delta > 0 and reason is not None and reason not in PointsReason.NOT_EARNED else 0
+        pending = db.session.info.setdefault('points_changed', {})
+        target, total, total_earned = pending.get(id(user), (user, 0, 0))
+        pending[id(user)] = (target, total + delta, total_earned + earned)
+
+
+@event.listens_for(User.points, 'set', active_history=True)
+def _points_set(target, value, oldvalue, initiator):
+    # Прямое присваивание User.points (в обход points.py и журнала - в недельный рейтинг не идет)
+    if not isinstance(oldvalue, int):
+        oldvalue = 0
+    note_points_change(target, (value or 0) - oldvalue)
+
+
+@event.listens_for(Session, 'before_commit')
+def _collect_points_changes(session):
+    # Фиксация точки сохранения (begin_nested) - еще не commit всей транзакции
+    if session.in_nested_transaction():
+        return
+    pending = session.info.pop('points_changed', None)
+    if pending:
+        session.info['points_entries'] = [(user_entry(user), earned) for user, _, earned in pending.values()
+                                          if user.id is not None]
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_points_changes(session):
+    if session.in_nested_transaction():
+        return
+    for entry, earned in session.info.pop('points_entries', ()):
+        leaderboards.points_changed(entry, earned)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_points_changes(session, previous_transaction):
+    # Откат точки сохранения (begin_nested) не отменяет изменений внешней транзакции
+    if previous_transaction.parent is None:
+        session.info.pop('points_changed', None)
+        session.info.pop('points_entries', None)
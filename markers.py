@@ -0,0 +1,306 @@
+"""
+Выборка и сериализация маркеров проблем для карты
+"""
+import json
+import secrets
+import struct
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, List, Iterable, Callable, Tuple
+from sqlalchemy import or_
+from models import db, Problem, ProblemTombstone, Vote
+from constants import ProblemStatus, ProblemCategory
+from geo import BBox, cell_ranges, bbox_around, distance_m
+from votes import vote_buffer
+
+# Запас по времени для курсора: изменения, закоммиченные чуть позже чтения,
+# попадут в следующую дельту (повторно присланные маркеры клиент просто обновит)
+DELTA_CURSOR_SKEW = timedelta(seconds=2)
+# Сколько хранить отметки об удалении; более старый курсор требует полной перезагрузки
+TOMBSTONE_RETENTION = timedelta(days=7)
+
+# Бинарный формат маркеров: заголовок (сигнатура, версия, количество),
+# затем записи id, lat, lng (float32), severity, код категории, код статуса
+COMPACT_MAGIC = b'ECOM'
+COMPACT_HEADER = struct.Struct('<4sBI')
+COMPACT_RECORD = struct.Struct('<IffBBB')
+
+# Сколько проблем можно запросить в problem_states за раз
+MAX_STATE_IDS = 500
+
+
+def filter_bbox(query, bbox: Optional[BBox]):
+    """
+    Ограничить запрос проблем областью карты.
+    Сначала отбор по ячейкам сетки (индекс geo_cell, status), затем точный фильтр по координатам.
+    """
+    if bbox is None:
+        return query
+
+    south, west, north, east = bbox
+    ranges = cell_ranges(bbox)
+    if ranges is not None:
+        query = query.filter(or_(*[Problem.geo_cell.between(lo, hi) for lo, hi in ranges]))
+    return query.filter(Problem.lat.between(south, north), Problem.lng.between(west, east))
+
+
+def open_problems_query(bbox: Optional[BBox] = None):
+    """Запрос незавершенных проблем, при наличии bbox - только в видимой области"""
+    return filter_bbox(Problem.query.filter(Problem.status != ProblemStatus.COMPLETED), bbox)
+
+
+def marker_dict(p: Problem) -> dict:
+    """Данные маркера, которые ожидает карта (index.html)"""
+    return {
+        'id': p.id,
+        'lat': p.lat,
+        'lng': p.lng,
+        'title': p.title,
+        'description': p.description,
+        'category': p.category,
+        'severity': p.severity,
+        'reward': p.reward,
+        'status': p.status,
+        'photo': p.photo, # URL фото
+        'likes': p.likes,
+        'dislikes': p.dislikes
+    }
+
+
+def problem_details(p: Problem) -> dict:
+    """Полные данные проблемы (для ленивой загрузки при компактном формате маркеров)"""
+    details = marker_dict(p)
+    details.update({
+        'assigned_to': p.assigned_to,
+        'is_completed': p.is_completed,
+        'created_at': p.created_at.isoformat() if p.created_at else None
+    })
+    return details
+
+
+def get_markers(bbox: Optional[BBox] = None) -> List[dict]:
+    """Список маркеров незавершенных проблем (в bbox, если задан)"""
+    return [marker_dict(p) for p in open_problems_query(bbox).all()]
+
+
+def problem_states(problem_ids: List[int], user_id: Optional[int] = None) -> dict:
+    """
+    Статус, исполнитель, счетчики голосов и голос пользователя для набора проблем:
+    {id: {...}}. Два запроса IN (...) вместо пары запросов на каждую проблему.
+    Несуществующие id в ответ не попадают.
+    """
+    problem_ids = list(dict.fromkeys(problem_ids))[:MAX_STATE_IDS]
+    if not problem_ids:
+        return {}
+    rows = (db.session.query(Problem.id, Problem.status, Problem.assigned_to, Problem.is_completed,
+                             Problem.completed_by, Problem.likes, Problem.dislikes)
+            .filter(Problem.id.in_(problem_ids)))
+    user_votes = {}
+    if user_id is not None:
+        user_votes = dict(db.session.query(Vote.problem_id, Vote.vote_type)
+                          .filter(Vote.user_id == user_id, Vote.problem_id.in_(problem_ids)))
+    pending = vote_buffer.pending(problem_ids)
+
+    states = {}
+    for row in rows:
+        likes, dislikes = pending.get(row.id, (0, 0))
+        states[row.id] = {
+            'status': row.status,
+            'assigned_to': row.assigned_to,
+            'is_completed': row.is_completed,
+            'completed_by': row.completed_by,
+            'likes': (row.likes or 0) + likes,
+            'dislikes': (row.dislikes or 0) + dislikes,
+            'user_vote': user_votes.get(row.id)
+        }
+    return states
+
+
+def find_nearby(lat: float, lng: float, radius_m: float,
+                category: Optional[str] = None, limit: int = 5) -> List[dict]:
+    """
+    Ближайшие незавершенные проблемы в радиусе radius_m (k ближайших, k=limit).
+    Кандидаты отбираются по ячейкам сетки описанного квадрата, затем точное расстояние.
+    """
+    query = open_problems_query(bbox_around(lat, lng, radius_m)).with_entities(
+        Problem.id, Problem.lat, Problem.lng, Problem.title, Problem.category,
+        Problem.status, Problem.likes)
+    if category:
+        query = query.filter(Problem.category == category)
+
+    candidates = []
+    for row in query:
+        distance = distance_m(lat, lng, row.lat, row.lng)
+        if distance <= radius_m:
+            candidates.append({
+                'id': row.id,
+                'title': row.title,
+                'category': row.category,
+                'status': row.status,
+                'likes': row.likes,
+                'lat': row.lat,
+                'lng': row.lng,
+                'distance_m': round(distance, 1)
+            })
+    candidates.sort(key=lambda c: c['distance_m'])
+    return candidates[:limit]
+
+
+def encode_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# --- Компактные форматы маркеров ---
+
+def _code(codes: List[str], value: Optional[str]) -> int:
+    try:
+        return codes.index(value)
+    except ValueError:
+        return 0
+
+
+def _compact_rows(bbox: Optional[BBox]):
+    """Только поля, нужные для отрисовки маркера (без описания, фото и т.д.)"""
+    return open_problems_query(bbox).with_entities(
+        Problem.id, Problem.lat, Problem.lng, Problem.severity, Problem.category, Problem.status).all()
+
+
+def columnar_markers(bbox: Optional[BBox] = None) -> dict:
+    """
+    Маркеры в виде колонок: значения полей - параллельные массивы,
+    категории и статусы - индексы в таблицах categories/statuses
+    """
+    rows = _compact_rows(bbox)
+    return {
+        'format': 'columnar',
+        'categories': ProblemCategory.CODES,
+        'statuses': ProblemStatus.ALL,
+        'id': [r.id for r in rows],
+        'lat': [round(r.lat, 6) for r in rows],
+        'lng': [round(r.lng, 6) for r in rows],
+        'severity': [r.severity or 0 for r in rows],
+        'category': [_code(ProblemCategory.CODES, r.category) for r in rows],
+        'status': [_code(ProblemStatus.ALL, r.status) for r in rows]
+    }
+
+
+def binary_markers(bbox: Optional[BBox] = None) -> bytes:
+    """Маркеры в упакованном бинарном виде (15 байт на маркер, little-endian)"""
+    rows = _compact_rows(bbox)
+    buffer = bytearray(COMPACT_HEADER.size + COMPACT_RECORD.size * len(rows))
+    COMPACT_HEADER.pack_into(buffer, 0, COMPACT_MAGIC, 1, len(rows))
+    offset = COMPACT_HEADER.size
+    for r in rows:
+        COMPACT_RECORD.pack_into(buffer, offset, r.id, r.lat, r.lng,
+                                 max(0, min(255, r.severity or 0)),
+                                 _code(ProblemCategory.CODES, r.category),
+                                 _code(ProblemStatus.ALL, r.status))
+        offset += COMPACT_RECORD.size
+    return bytes(buffer)
+
+
+class MarkerSnapshot:
+    """
+    Версионный кэш готовых (уже закодированных в JSON) ответов со списком маркеров.
+    Любая запись, меняющая проблемы или счетчики голосов, вызывает bump(),
+    после чего снимки строятся заново при первом чтении.
+    Версия действует в рамках процесса; ETag включает случайный префикс процесса,
+    чтобы после перезапуска не совпадать со старыми ETag клиентов.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.version = 0
+        self._prefix = secrets.token_hex(4)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    @property
+    def etag(self) -> str:
+        return f'{self._prefix}-{self.version}'
+
+    def get(self, key, build: Callable[[], bytes]) -> Tuple[str, bytes, int]:
+        """
+        Снимок для ключа (например, формат и bbox): (etag, тело ответа, курсор дельта-синхронизации).
+        build() возвращает уже закодированное тело.
+        """
+        with self._lock:
+            version = self.version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        cursor = current_cursor()
+        body = build()
+        entry = (f'{self._prefix}-{version}', body, cursor)
+
+        with self._lock:
+            # Пока строили снимок, данные могли измениться - такой снимок не сохраняем
+            if self.version == version:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+
+marker_snapshot = MarkerSnapshot()
+
+
+# --- Дельта-синхронизация ---
+
+def make_cursor(moment: datetime) -> int:
+    """Курсор синхронизации - время в миллисекундах"""
+    return int((moment - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def parse_cursor(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(value))
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def current_cursor() -> int:
+    return make_cursor(datetime.utcnow() - DELTA_CURSOR_SKEW)
+
+
+def get_delta(since: datetime, bbox: Optional[BBox] = None) -> dict:
+    """
+    Изменения маркеров с момента since: новые/измененные, удаленные
+    (включая выполненные, которые больше не показываются) и новый курсор.
+    Если курсор старше срока хранения отметок об удалении - полный список.
+    """
+    cursor = current_cursor()
+    if since < datetime.utcnow() - TOMBSTONE_RETENTION:
+        return {'mode': 'delta', 'full': True, 'changed': get_markers(bbox),
+                'deleted': [], 'cursor': cursor}
+
+    changed, deleted = [], []
+    for p in filter_bbox(Problem.query.filter(Problem.updated_at >= since), bbox):
+        if p.status == ProblemStatus.COMPLETED:
+            deleted.append(p.id)
+        else:
+            changed.append(marker_dict(p))
+    deleted.extend(pid for (pid,) in db.session.query(ProblemTombstone.problem_id)
+                   .filter(ProblemTombstone.deleted_at >= since))
+
+    return {'mode': 'delta', 'full': False, 'changed': changed,
+            'deleted': deleted, 'cursor': cursor}
+
+
+def record_deletions(problem_ids: Iterable[int]) -> None:
+    """
+    Записать отметки об удалении проблем (в текущей транзакции, до commit)
+    и заодно убрать устаревшие отметки
+    """
+    now = datetime.utcnow()
+    for pid in problem_ids:
+        db.session.add(ProblemTombstone(problem_id=pid, deleted_at=now))
+    ProblemTombstone.query.filter(ProblemTombstone.deleted_at < now - TOMBSTONE_RETENTION).delete()
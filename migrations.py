@@ -0,0 +1,186 @@
+"""
+Версионные миграции схемы БД.
+
+db.create_all() создает только отсутствующие таблицы и не изменяет существующие,
+поэтому новые колонки и индексы для уже развернутых баз добавляются здесь.
+Текущая версия схемы хранится в таблице schema_version.
+"""
+import json
+from datetime import datetime
+from sqlalchemy import inspect, text
+from models import db
+from geo import cell_for
+
+
+def _column_exists(table: str, column: str) -> bool:
+    return column in {c['name'] for c in inspect(db.engine).get_columns(table)}
+
+
+def _add_column(table: str, column: str, ddl_type: str) -> None:
+    if not _column_exists(table, column):
+        db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl_type}'))
+
+
+def _create_index(name: str, table: str, columns: str) -> None:
+    db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'))
+
+
+# --- Шаги миграций (каждый выполняется один раз) ---
+
+def _m001_problem_geo_cell():
+    """Ячейка пространственной сетки для проблем"""
+    _add_column('problem', 'geo_cell', 'INTEGER')
+    rows = db.session.execute(text('SELECT id, lat, lng FROM problem WHERE geo_cell IS NULL')).fetchall()
+    for row in rows:
+        db.session.execute(text('UPDATE problem SET geo_cell = :cell WHERE id = :id'),
+                           {'cell': cell_for(row.lat, row.lng), 'id': row.id})
+    _create_index('ix_problem_geo_cell_status', 'problem', 'geo_cell, status')
+
+
+def _m002_problem_updated_at():
+    """Время последнего изменения проблемы для дельта-синхронизации"""
+    _add_column('problem', 'updated_at', 'DATETIME')
+    db.session.execute(text('UPDATE problem SET updated_at = COALESCE(completed_at, created_at) WHERE updated_at IS NULL'))
+    _create_index('ix_problem_updated_at', 'problem', 'updated_at')
+
+
+def _m003_daily_stats_backfill():
+    """Заполнение ежедневной сводки по существующим данным"""
+    import stats
+    stats.rebuild()
+
+
+def _m004_created_at_indexes():
+    """Индексы по времени для временных рядов и фильтров по датам"""
+    _create_index('ix_problem_created_at', 'problem', 'created_at')
+    _create_index('ix_problem_completed_at', 'problem', 'completed_at')
+    _create_index('ix_complaint_created_at', 'complaint', 'created_at')
+    _create_index('ix_order_created_at', 'order', 'created_at')
+
+
+def _m005_user_points_index():
+    """Индекс по баллам для расчета места в рейтинге"""
+    _create_index('ix_user_points', 'user', 'points')
+
+
+def _m006_hot_query_indexes():
+    """Составные индексы для частых фильтров и сортировок (см. check_query_plans)"""
+    _create_index('ix_problem_status_assigned', 'problem', 'status, assigned_to')
+    _create_index('ix_problem_assigned_status', 'problem', 'assigned_to, status')
+    _create_index('ix_problem_user_created', 'problem', 'user_id, created_at')
+    _create_index('ix_comment_problem_created', 'comment', 'problem_id, created_at')
+    _create_index('ix_complaint_status_created', 'complaint', 'status, created_at')
+    _create_index('ix_complaint_problem_id', 'complaint', 'problem_id')
+    _create_index('ix_order_user_created', 'order', 'user_id, created_at')
+    _create_index('ix_task_completion_problem_id', 'task_completion', 'problem_id')
+    _create_index('ix_vote_user_id', 'vote', 'user_id')
+
+
+def _m007_user_badges():
+    """Перенос достижений из JSON-колонки user.badges в таблицу user_badge"""
+    rows = db.session.execute(text("SELECT id, badges FROM \"user\" WHERE badges IS NOT NULL AND badges != '[]'")).fetchall()
+    for row in rows:
+        try:
+            badges = json.loads(row.badges)
+        except (ValueError, TypeError):
+            continue
+        for badge in badges:
+            if not isinstance(badge, dict) or not badge.get('name'):
+                continue
+            try:
+                earned_at = datetime.fromisoformat(badge['earned_at'])
+            except (KeyError, ValueError, TypeError):
+                earned_at = None
+            db.session.execute(text(
+                'INSERT OR IGNORE INTO user_badge (user_id, name, icon, earned_at) '
+                'VALUES (:user_id, :name, :icon, :earned_at)'
+            ), {'user_id': row.id, 'name': badge['name'], 'icon': badge.get('icon'), 'earned_at': earned_at})
+
+
+def _m008_points_opening_balances():
+    """Начальные записи журнала баллов для существующих балансов"""
+    import points
+    points.reconcile()
+
+
+MIGRATIONS = [
+    (1, _m001_problem_geo_cell),
+    (2, _m002_problem_updated_at),
+    (3, _m003_daily_stats_backfill),
+    (4, _m004_created_at_indexes),
+    (5, _m005_user_points_index),
+    (6, _m006_hot_query_indexes),
+    (7, _m007_user_badges),
+    (8, _m008_points_opening_balances),
+]
+
+
+def get_schema_version() -> int:
+    db.session.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    version = db.session.execute(text('SELECT MAX(version) FROM schema_version')).scalar()
+    return version or 0
+
+
+def run_migrations(logger=None) -> int:
+    """
+    Применяет все миграции новее текущей версии схемы.
+    Вызывается из init_db() после db.create_all(). Возвращает итоговую версию.
+    """
+    version = get_schema_version()
+    for target, step in MIGRATIONS:
+        if target <= version:
+            continue
+        if logger:
+            logger.info(f"Миграция схемы БД до версии {target}: {step.__doc__}")
+        step()
+        db.session.execute(text('INSERT INTO schema_version (version) VALUES (:v)'), {'v': target})
+        db.session.commit()
+        version = target
+    return version
+
+
+# --- Проверка планов запросов ---
+
+def _hot_queries():
+    """Частые запросы приложения и индексы, которые они должны использовать"""
+    from datetime import datetime
+    from models import User, Problem, Comment, Complaint, Order, Vote
+    from constants import ProblemStatus, ComplaintStatus
+    return [
+        ('доступные задания', ('ix_problem_status_assigned', 'ix_problem_assigned_status'),
+         Problem.query.filter_by(status=ProblemStatus.REPORTED, assigned_to=None)),
+        ('мои задания', ('ix_problem_assigned_status', 'ix_problem_status_assigned'),
+         Problem.query.filter_by(assigned_to=1, status=ProblemStatus.ASSIGNED)),
+        ('мои заявки', ('ix_problem_user_created',),
+         Problem.query.filter_by(user_id=1).order_by(Problem.created_at.desc())),
+        ('маркеры по ячейкам', ('ix_problem_geo_cell_status',),
+         Problem.query.filter(Problem.geo_cell.between(1, 2), Problem.status != ProblemStatus.COMPLETED)),
+        ('дельта маркеров', ('ix_problem_updated_at',),
+         Problem.query.filter(Problem.updated_at >= datetime(2000, 1, 1))),
+        ('комментарии', ('ix_comment_problem_created',),
+         Comment.query.filter_by(problem_id=1).order_by(Comment.created_at.asc())),
+        ('жалобы на модерации', ('ix_complaint_status_created',),
+         Complaint.query.filter_by(status=ComplaintStatus.PENDING)),
+        ('заказы пользователя', ('ix_order_user_created',),
+         Order.query.filter_by(user_id=1)),
+        ('голос пользователя', ('sqlite_autoindex_vote_1', 'ix_vote_user_id'),
+         Vote.query.filter_by(problem_id=1, user_id=1)),
+        ('место в рейтинге', ('ix_user_points',),
+         User.query.filter(User.points > 100)),
+    ]
+
+
+def check_query_plans() -> list:
+    """
+    Выполняет EXPLAIN QUERY PLAN (SQLite) для частых запросов и возвращает
+    список (название, ожидаемые индексы, план) для тех, что не используют ни один из них.
+    """
+    failures = []
+    for name, indexes, query in _hot_queries():
+        compiled = query.statement.compile(db.engine)
+        params = tuple(compiled.params[key] for key in compiled.positiontup)
+        rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+        plan = ' | '.join(row[-1] for row in rows)
+        if not any(f'INDEX {index}' in plan for index in indexes):
+            failures.append((name, indexes, plan))
+    return failures
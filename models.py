@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-import json
+from sqlalchemy import event
 from datetime import datetime
+from geo import cell_for
 
 # Инициализация объекта БД
 db = SQLAlchemy()
@@ -15,10 +16,10 @@ class User(db.Model, UserMixin):
     password_hash = db.Column(db.String(128))
     
     # Геймификация и статистика
-    points = db.Column(db.Integer, default=0)       # Баллы ФМ
+    points = db.Column(db.Integer, default=0, index=True)  # Баллы ФМ (индекс - для места в рейтинге)
     level = db.Column(db.Integer, default=1)        # Уровень
     experience = db.Column(db.Integer, default=0)   # Опыт
-    badges = db.Column(db.Text, default='[]')       # JSON строка со списком достижений
+    badges = db.Column(db.Text, default='[]')       # Устарело: достижения хранятся в UserBadge (перенесены миграцией)
     
     # Роли и настройки профиля
     is_admin = db.Column(db.Boolean, default=False)
@@ -48,63 +49,60 @@ class User(db.Model, UserMixin):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
-    # Работа с бейджами (храним как JSON список словарей)
+    # Работа с бейджами (таблица UserBadge, названия кэшируются во множестве на время жизни объекта)
+    @property
+    def badge_names(self):
+        names = getattr(self, '_badge_names', None)
+        if names is None:
+            names = self._badge_names = {b.name for b in self.earned_badges}
+        return names
+    
     def add_badge(self, badge_name, badge_icon):
-        try:
-            badges_list = json.loads(self.badges)
-        except:
-            badges_list = []
-        
         # Проверяем, есть ли уже такой бейдж, чтобы не дублировать
-        if not any(b.get('name') == badge_name for b in badges_list):
-            badge = {
-                'name': badge_name,
-                'icon': badge_icon,
-                'earned_at': datetime.utcnow().isoformat()
-            }
-            badges_list.append(badge)
-            self.badges = json.dumps(badges_list, ensure_ascii=False)
-            return True
-        return False
+        if badge_name in self.badge_names:
+            return False
+        self.earned_badges.append(UserBadge(name=badge_name, icon=badge_icon))
+        self.badge_names.add(badge_name)
+        return True
     
     def get_badges(self):
-        try:
-            return json.loads(self.badges)
-        except:
-            return []
+        return [b.to_dict() for b in sorted(self.earned_badges, key=lambda b: b.earned_at or datetime.min)]
 
     def check_achievements(self):
-        """Проверка и начисление достижений"""
-        achievements = []
-        
-        # Проверяем достижения (без заказов, чтобы избежать циклического импорта)
-        if self.total_reports >= 1 and not self.has_achievement('Первая проблема'):
-            self.add_badge('Первая проблема', 'fa-map-marker-alt')
-            achievements.append('Первая проблема')
-        
-        if self.total_reports >= 10 and not self.has_achievement('10 проблем'):
-            self.add_badge('10 проблем', 'fa-flag')
-            achievements.append('10 проблем')
-        
-        if self.total_completed >= 5 and not self.has_achievement('5 решений'):
-            self.add_badge('5 решений', 'fa-check-circle')
-            achievements.append('5 решений')
-        
-        if self.points >= 500 and not self.has_achievement('Богатый волонтер'):
-            self.add_badge('Богатый волонтер', 'fa-coins')
-            achievements.append('Богатый волонтер')
-        
-        if self.experience >= 1000 and not self.has_achievement('Опытный волонтер'):
-            self.add_badge('Опытный волонтер', 'fa-star')
-            achievements.append('Опытный волонтер')
-        
-        # Проверка заказов будет выполняться отдельно при создании заказа
-        return achievements
+        """Проверка всех достижений (правила - в achievements.py)"""
+        from achievements import check_all  # achievements импортирует модели
+        return check_all(self)
 
     def has_achievement(self, name):
         """Проверить, есть ли достижение"""
-        badges = self.get_badges()
-        return any(b.get('name') == name for b in badges)
+        return name in self.badge_names
+
+class UserBadge(db.Model):
+    """Полученное пользователем достижение"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    icon = db.Column(db.String(50))
+    earned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref=db.backref('earned_badges', cascade='all, delete-orphan'))
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='unique_user_badge'),
+        db.Index('ix_user_badge_name', 'name'),  # "У кого есть достижение X"
+    )
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'icon': self.icon,
+            'earned_at': self.earned_at.isoformat() if self.earned_at else None
+        }
+    
+    @classmethod
+    def holders(cls, name):
+        """Запрос пользователей, получивших достижение name"""
+        return User.query.join(cls, cls.user_id == User.id).filter(cls.name == name)
 
 class Problem(db.Model):
     """Модель проблемы/заявки на карте"""
@@ -113,6 +111,7 @@ class Problem(db.Model):
     # Геоданные
     lat = db.Column(db.Float, nullable=False)
     lng = db.Column(db.Float, nullable=False)
+    geo_cell = db.Column(db.Integer)  # Ячейка сетки пространственного индекса (см. geo.py)
     
     # Описание
     title = db.Column(db.String(200), nullable=False)
@@ -138,9 +137,10 @@ class Problem(db.Model):
     is_completed = db.Column(db.Boolean, default=False)  # Выполнена ли задача
     
     # Метаданные
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     assigned_at = db.Column(db.DateTime)  # Когда взяли в работу
-    completed_at = db.Column(db.DateTime)  # Когда выполнили
+    completed_at = db.Column(db.DateTime, index=True)  # Когда выполнили
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Для дельта-синхронизации карты
     
     # Отношения (для удобного доступа через ORM)
     user = db.relationship('User', foreign_keys=[user_id], backref='reported_problems')
@@ -148,6 +148,28 @@ class Problem(db.Model):
     completer = db.relationship('User', foreign_keys=[completed_by], backref='completed_problems')
     comments = db.relationship('Comment', backref='problem_comment', cascade='all,delete')
     task_completion = db.relationship('TaskCompletion', backref='problem_report', uselist=False, cascade='all,delete')
+    
+    # Пространственный индекс: выборка маркеров по ячейкам видимой области карты
+    __table_args__ = (
+        db.Index('ix_problem_geo_cell_status', 'geo_cell', 'status'),
+        db.Index('ix_problem_status_assigned', 'status', 'assigned_to'),  # Доступные задания, счетчики по статусу
+        db.Index('ix_problem_assigned_status', 'assigned_to', 'status'),  # Мои задания
+        db.Index('ix_problem_user_created', 'user_id', 'created_at'),     # Мои заявки (по новизне)
+    )
+
+
+@event.listens_for(Problem, 'before_insert')
+@event.listens_for(Problem, 'before_update')
+def _update_problem_geo_cell(mapper, connection, target):
+    """Поддерживаем ячейку сетки в актуальном состоянии при создании и редактировании"""
+    if target.lat is not None and target.lng is not None:
+        target.geo_cell = cell_for(target.lat, target.lng)
+
+class ProblemTombstone(db.Model):
+    """Отметка об удалении проблемы (для дельта-синхронизации маркеров карты)"""
+    id = db.Column(db.Integer, primary_key=True)
+    problem_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 class Comment(db.Model):
     """Модель комментария к проблеме"""
@@ -159,6 +181,8 @@ class Comment(db.Model):
     
     # Отношения
     user = db.relationship('User', backref='user_comments')
+    
+    __table_args__ = (db.Index('ix_comment_problem_created', 'problem_id', 'created_at'),)
 
 class Complaint(db.Model):
     """Модель жалобы на контент"""
@@ -169,7 +193,7 @@ class Complaint(db.Model):
     reason = db.Column(db.String(100)) # spam, fake, offensive, duplicate, other
     description = db.Column(db.Text)
     status = db.Column(db.String(20), default='pending') # pending, resolved, rejected
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Новые поля для обработки жалоб
     resolved_at = db.Column(db.DateTime)
@@ -181,6 +205,11 @@ class Complaint(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref='user_complaints')
     admin = db.relationship('User', foreign_keys=[resolved_by], backref='resolved_complaints')
     
+    __table_args__ = (
+        db.Index('ix_complaint_status_created', 'status', 'created_at'),  # Очередь модерации
+        db.Index('ix_complaint_problem_id', 'problem_id'),
+    )
+    
 class TaskCompletion(db.Model):
     """Модель фотоотчета о выполнении задания"""
     id = db.Column(db.Integer, primary_key=True)
@@ -202,6 +231,8 @@ class TaskCompletion(db.Model):
     # Отношения
     user = db.relationship('User', backref='task_completions')
     # проблема уже связана через problem_report
+    
+    __table_args__ = (db.Index('ix_task_completion_problem_id', 'problem_id'),)
 
 class Order(db.Model):
     """Модель заказа из магазина"""
@@ -220,11 +251,13 @@ class Order(db.Model):
     
     # Статус заказа
     status = db.Column(db.String(20), default='pending')  # pending, processing, shipped, delivered, cancelled
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
     
     # Отношения
     user = db.relationship('User', backref='user_orders')
+    
+    __table_args__ = (db.Index('ix_order_user_created', 'user_id', 'created_at'),)
 
 class Vote(db.Model):
     """Модель голосования (лайки/дизлайки)"""
@@ -235,12 +268,58 @@ class Vote(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Уникальный индекс для предотвращения множественных голосов
-    __table_args__ = (db.UniqueConstraint('problem_id', 'user_id', name='unique_vote'),)
+    __table_args__ = (
+        db.UniqueConstraint('problem_id', 'user_id', name='unique_vote'),
+        db.Index('ix_vote_user_id', 'user_id'),
+    )
     
     # Отношения
     user = db.relationship('User', backref='user_votes')
     problem = db.relationship('Problem', backref='problem_votes')
 
+class PointsTransaction(db.Model):
+    """Запись журнала баллов (только добавление, баланс - User.points; см. points.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(30), nullable=False)
+    ref_id = db.Column(db.Integer)  # ID связанной записи (проблемы, заказа, пользователя)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (db.Index('ix_points_transaction_user_created', 'user_id', 'created_at'),)
+
+class DailyProgress(db.Model):
+    """Счетчики действий пользователя за день (для ежедневных челленджей, см. challenges.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    reports = db.Column(db.Integer, nullable=False, default=0)
+    completions = db.Column(db.Integer, nullable=False, default=0)
+    votes = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Integer, nullable=False, default=0)
+
+class Challenge(db.Model):
+    """Ежедневный челлендж: сделать target действий вида metric за день"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    metric = db.Column(db.String(20), nullable=False)  # reports, completions, votes, comments
+    target = db.Column(db.Integer, nullable=False)
+    reward = db.Column(db.Integer, default=0)
+    is_active = db.Column(db.Boolean, default=True)
+
+class DailyStats(db.Model):
+    """Ежедневная сводка показателей для дашбордов (см. stats.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    city = db.Column(db.String(100), nullable=False, default='')
+    category = db.Column(db.String(50), nullable=False, default='')  # Категория проблемы ('' - без категории)
+    metric = db.Column(db.String(50), nullable=False)  # problems_created, problems_completed, orders, points_issued, complaint:<причина>
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('day', 'city', 'category', 'metric', name='unique_daily_stat'),
+        db.Index('ix_daily_stats_metric_day', 'metric', 'day'),
+    )
+
 # --- Дополнительные модели (задел на будущее) ---
 
 class SensorData(db.Model):
@@ -0,0 +1,90 @@
+"""
+Keyset-пагинация и общие фильтры для списков админки
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    """Непрозрачный курсор из ключа сортировки (created_at, id)"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, item_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value: Optional[str]) -> Optional[Tuple[Optional[datetime], int]]:
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        created_at, item_id = json.loads(raw)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(item_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def page_size(request) -> int:
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except (ValueError, TypeError):
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    """Дата из строки YYYY-MM-DD (или полного ISO-формата)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def filter_date_range(query, column, request):
+    """
+    Фильтр по диапазону date_from..date_to (включительно; дата без времени - весь день)
+    """
+    date_from = parse_date(request.args.get('date_from'))
+    date_to_raw = request.args.get('date_to')
+    date_to = parse_date(date_to_raw)
+    if date_from:
+        query = query.filter(column >= date_from)
+    if date_to:
+        if len(date_to_raw) <= 10:
+            query = query.filter(column < date_to + timedelta(days=1))
+        else:
+            query = query.filter(column <= date_to)
+    return query
+
+
+def keyset_page(query, model, request) -> Tuple[List, Optional[str]]:
+    """
+    Страница записей, отсортированных от новых к старым по (created_at, id).
+    Вместо OFFSET используется условие "строго после курсора", поэтому стоимость
+    запроса не растет с номером страницы. Возвращает (записи, курсор следующей страницы).
+    """
+    limit = page_size(request)
+    cursor = decode_cursor(request.args.get('cursor'))
+    if cursor:
+        created_at, item_id = cursor
+        if created_at is None:
+            query = query.filter(model.created_at.is_(None), model.id < item_id)
+        else:
+            query = query.filter(or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < item_id),
+                model.created_at.is_(None)
+            ))
+
+    items = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return items, next_cursor
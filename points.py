@@ -0,0 +1,129 @@
+"""
+Начисление и списание баллов.
+
+Баланс меняется атомарным UPDATE user SET points = points + :delta (без чтения
+значения в Python), и в той же транзакции в журнал PointsTransaction
+добавляется запись. Поэтому параллельные запросы не теряют изменения,
+а журнал позволяет проверять баланс и строить рейтинги по заработанным баллам.
+Commit выполняет вызывающий код.
+"""
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, func, insert, select, update
+from models import db, User, PointsTransaction
+from constants import PointsReason
+import stats
+from leaderboard import note_points_change
+
+_users = User.__table__
+
+
+def _after_change(user: User, delta: int, reason: str) -> None:
+    # Значение в объекте устарело - перечитается из БД при следующем обращении
+    db.session.expire(user, ['points'])
+    stats.record_points_issued(user, delta, reason)
+    note_points_change(user, delta, reason)
+
+
+def award(user: User, delta: int, reason: str, ref_id: Optional[int] = None) -> None:
+    """Изменить баланс на delta (может быть отрицательным) и записать операцию в журнал"""
+    if not delta:
+        return
+    db.session.execute(update(User).where(User.id == user.id)
+                       .values(points=func.coalesce(User.points, 0) + delta)
+                       .execution_options(synchronize_session=False))
+    db.session.add(PointsTransaction(user_id=user.id, delta=delta, reason=reason, ref_id=ref_id))
+    _after_change(user, delta, reason)
+
+
+def spend(user: User, amount: int, reason: str, ref_id: Optional[int] = None) -> bool:
+    """
+    Списать amount, только если хватает баллов (проверка и списание - один UPDATE).
+    Возвращает False, если баллов недостаточно.
+    """
+    if amount <= 0:
+        return True
+    result = db.session.execute(update(User).where(User.id == user.id, User.points >= amount)
+                                .values(points=User.points - amount)
+                                .execution_options(synchronize_session=False))
+    if not result.rowcount:
+        return False
+    db.session.add(PointsTransaction(user_id=user.id, delta=-amount, reason=reason, ref_id=ref_id))
+    _after_change(user, -amount, reason)
+    return True
+
+
+def deduct_up_to(user: User, amount: int, reason: str, ref_id: Optional[int] = None) -> int:
+    """Списать до amount баллов, не уводя баланс в минус. Возвращает списанное"""
+    current = db.session.execute(select(User.points).where(User.id == user.id)).scalar() or 0
+    taken = min(amount, max(current, 0))
+    if taken and not spend(user, taken, reason, ref_id):
+        return 0
+    return taken
+
+
+def set_balance(user: User, target: int, reason: str) -> None:
+    """Установить баланс (правка администратором) - операцией на разницу с текущим значением"""
+    current = db.session.execute(select(User.points).where(User.id == user.id)).scalar() or 0
+    award(user, target - current, reason)
+
+
+def award_many(entries: Iterable[Tuple[User, int, str, Optional[int]]]) -> None:
+    """
+    Пакетное начисление: [(пользователь, delta, причина, ref_id), ...].
+    Одно UPDATE ... executemany на всех пользователей и одна пакетная вставка в журнал.
+    """
+    entries = [e for e in entries if e[1]]
+    if not entries:
+        return
+    totals = defaultdict(int)
+    for user, delta, _, _ in entries:
+        totals[user.id] += delta
+
+    db.session.execute(
+        _users.update().where(_users.c.id == bindparam('user_id'))
+        .values(points=func.coalesce(_users.c.points, 0) + bindparam('delta')),
+        [{'user_id': user_id, 'delta': delta} for user_id, delta in totals.items()]
+    )
+    db.session.execute(insert(PointsTransaction), [
+        {'user_id': user.id, 'delta': delta, 'reason': reason, 'ref_id': ref_id}
+        for user, delta, reason, ref_id in entries
+    ])
+    for user, delta, reason, _ in entries:
+        _after_change(user, delta, reason)
+
+
+def discrepancies() -> List[Tuple[int, int, int]]:
+    """Пользователи, у которых баланс не совпадает с суммой журнала: [(id, баланс, сумма журнала)]"""
+    ledger = (select(PointsTransaction.user_id, func.sum(PointsTransaction.delta).label('total'))
+              .group_by(PointsTransaction.user_id).subquery())
+    balance = func.coalesce(User.points, 0)
+    total = func.coalesce(ledger.c.total, 0)
+    return [tuple(row) for row in db.session.query(User.id, balance, total)
+            .outerjoin(ledger, ledger.c.user_id == User.id)
+            .filter(balance != total).all()]
+
+
+def reconcile() -> int:
+    """
+    Сверка: для расхождений добавляет в журнал операцию RECONCILE на разницу,
+    баланс пользователя считается верным. Возвращает число исправленных пользователей.
+    """
+    rows = discrepancies()
+    db.session.add_all([PointsTransaction(user_id=user_id, delta=balance - total, reason=PointsReason.RECONCILE)
+                        for user_id, balance, total in rows])
+    return len(rows)
+
+
+def open_balances() -> int:
+    """
+    Начальные записи журнала для пользователей без единой операции (например,
+    созданных при инициализации БД). Расхождения у остальных не трогает -
+    их показывает и исправляет reconcile-points. Возвращает число записей.
+    """
+    has_ledger = select(PointsTransaction.id).where(PointsTransaction.user_id == User.id).exists()
+    rows = (db.session.query(User.id, User.points)
+            .filter(func.coalesce(User.points, 0) != 0, ~has_ledger).all())
+    db.session.add_all([PointsTransaction(user_id=user_id, delta=balance, reason=PointsReason.RECONCILE)
+                        for user_id, balance in rows])
+    return len(rows)
@@ -0,0 +1,75 @@
+"""
+Подсчет SQL-запросов: на каждый HTTP-запрос и в произвольном блоке кода.
+
+Нужен, чтобы ловить N+1: если число запросов эндпоинта растет вместе
+с числом строк в ответе, где-то не хватает joinedload/selectinload.
+"""
+import threading
+from contextlib import contextmanager
+from typing import List
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Если эндпоинт выполнил больше запросов, чем это значение, в лог пишется предупреждение
+DEFAULT_QUERY_COUNT_WARN = 30
+
+_local = threading.local()
+
+
+class QueryCounter:
+    """Счетчик запросов внутри блока count_queries()"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements: List[str] = []
+
+    def __repr__(self):
+        return f'<QueryCounter {self.count}>'
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.count += 1
+        counter.statements.append(statement)
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+@contextmanager
+def count_queries():
+    """
+    Считает SQL-запросы, выполненные в блоке (в текущем потоке):
+
+        with count_queries() as counter:
+            client.get('/api/orders')
+        assert counter.count <= 3
+    """
+    counter = QueryCounter()
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def init_query_counter(app, db) -> None:
+    """
+    Подключает счетчик к движку БД приложения.
+    Число запросов отдается в заголовке X-Query-Count (в режиме отладки/тестов)
+    и пишется в лог, если превышает QUERY_COUNT_WARN.
+    """
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _on_execute)
+
+    @app.after_request
+    def report_query_count(response):
+        count = g.get('query_count', 0)
+        if app.debug or app.testing:
+            response.headers['X-Query-Count'] = str(count)
+        limit = app.config.get('QUERY_COUNT_WARN', DEFAULT_QUERY_COUNT_WARN)
+        if limit and count > limit:
+            app.logger.warning('%s %s: %d SQL-запросов', request.method, request.path, count)
+        return response
@@ -0,0 +1,378 @@
+"""
+Данные "датчиков" из OpenWeatherMap: погода и загрязнение воздуха.
+
+Оба запроса к провайдеру выполняются параллельно через общую сессию с пулом
+соединений (keep-alive) и общим сроком SENSOR_DEADLINE, поэтому задержка равна
+задержке самого медленного из них, а не сумме.
+
+Показания кэшируются по ячейкам сетки (координаты округляются до SENSOR_GRID_STEP
+градуса) на SENSOR_CACHE_TTL секунд, размер кэша ограничен (LRU). Одновременные
+запросы одной ячейки при промахе ждут один общий запрос к API (single-flight),
+поэтому число обращений к провайдеру зависит от числа разных районов, а не зрителей.
+
+Провайдер защищен автоматом (CircuitBreaker): при высокой доле ошибок запросы к нему
+на время прекращаются и сразу отдаются последние удачные показания ячейки
+(даже просроченные) или случайные данные - с пометкой stale.
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from constants import ConfigDefaults
+
+WEATHER_URL = 'https://api.openweathermap.org/data/2.5/weather'
+AIR_POLLUTION_URL = 'http://api.openweathermap.org/data/2.5/air_pollution'
+# Соединений в пуле на хост и потоков для параллельных запросов
+POOL_SIZE = 10
+
+# Автомат: по скольким последним запросам считать долю ошибок, какая доля его
+# размыкает и сколько запросов нужно, чтобы вообще судить
+BREAKER_WINDOW = 20
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_MIN_CALLS = 5
+
+logger = logging.getLogger(__name__)
+
+
+class SensorError(Exception):
+    """Провайдер не вернул данные"""
+
+
+class CircuitOpenError(SensorError):
+    """Автомат разомкнут - к провайдеру не обращаемся"""
+
+
+class _Flight:
+    """Выполняющаяся загрузка ячейки, которую ждут остальные запросы"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class SensorCache:
+    """
+    LRU-кэш показаний по ячейкам: ключ -> (время загрузки, показания).
+    Просроченные записи не отдаются get(), но хранятся до вытеснения.
+    """
+
+    def __init__(self, step: float = ConfigDefaults.SENSOR_GRID_STEP, ttl: float = ConfigDefaults.SENSOR_CACHE_TTL,
+                 max_entries: int = ConfigDefaults.SENSOR_CACHE_SIZE, wait_timeout: float = 10.0):
+        self.step = step
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: Dict[tuple, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.step = app.config.get('SENSOR_GRID_STEP', ConfigDefaults.SENSOR_GRID_STEP)
+        self.ttl = app.config.get('SENSOR_CACHE_TTL', ConfigDefaults.SENSOR_CACHE_TTL)
+        self.max_entries = app.config.get('SENSOR_CACHE_SIZE', ConfigDefaults.SENSOR_CACHE_SIZE)
+
+    def get(self, key: tuple, load: Callable[[], dict]) -> dict:
+        """Показания ячейки из кэша или через load() (один вызов на ячейку одновременно)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                raise SensorError('Превышено время ожидания данных датчиков')
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = load()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            self.put(key, flight.value)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+        return flight.value
+
+    def peek(self, key: tuple) -> Optional[dict]:
+        """Последние сохраненные показания ячейки, даже просроченные"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def put(self, key: tuple, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+sensor_cache = SensorCache()
+
+
+class CircuitBreaker:
+    """
+    Автомат вокруг провайдера: closed - запросы идут; open - после доли ошибок
+    не меньше failure_rate в окне последних window запросов, запросы не идут
+    cooldown секунд; half_open - пропускается один пробный запрос, успех замыкает
+    автомат, ошибка снова размыкает.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, cooldown: float = ConfigDefaults.SENSOR_BREAKER_COOLDOWN, window: int = BREAKER_WINDOW,
+                 failure_rate: float = BREAKER_FAILURE_RATE, min_calls: int = BREAKER_MIN_CALLS):
+        self.cooldown = cooldown
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.state = self.CLOSED
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли сейчас обратиться к провайдеру"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return self.state != self.OPEN
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if success:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                    logger.info('Провайдер погоды снова доступен')
+                else:
+                    self._open()
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if (self.state == self.CLOSED and len(self._results) >= self.min_calls
+                    and failures >= self.failure_rate * len(self._results)):
+                self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        logger.warning(f'Провайдер погоды недоступен, запросы приостановлены на {self.cooldown} с')
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._results.clear()
+            self._probing = False
+
+
+breaker = CircuitBreaker()
+
+
+def cell_key(lat: float, lng: float, step: float) -> Tuple[int, int]:
+    """Ячейка сетки, в которую попадает точка"""
+    return int(round(lat / step)), int(round(lng / step))
+
+
+def cell_center(key: Tuple[int, int], step: float) -> Tuple[float, float]:
+    return round(key[0] * step, 6), round(key[1] * step, 6)
+
+
+class WeatherProvider:
+    """
+    Клиент OpenWeatherMap: общая requests.Session с пулом соединений
+    и пул потоков для одновременных запросов погоды и загрязнения воздуха.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, deadline: float = ConfigDefaults.SENSOR_DEADLINE):
+        self.api_key = api_key
+        self.deadline = deadline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='sensors')
+
+    def init_app(self, app) -> None:
+        self.api_key = app.config.get('OPENWEATHER_API_KEY')
+        self.deadline = app.config.get('SENSOR_DEADLINE', ConfigDefaults.SENSOR_DEADLINE)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key) and self.api_key != 'ВАШ_API_KEY_ЗДЕСЬ'
+
+    def fetch_guarded(self, lat: float, lng: float) -> dict:
+        """fetch() через автомат: при разомкнутом автомате сразу CircuitOpenError"""
+        if not breaker.allow():
+            raise CircuitOpenError('Провайдер погоды временно отключен')
+        try:
+            conditions = self.fetch(lat, lng)
+        except Exception:
+            breaker.record(False)
+            raise
+        breaker.record(True)
+        return conditions
+
+    def _get_json(self, url: str, params: dict, timeout: float) -> Optional[dict]:
+        response = self.session.get(url, params=params, timeout=timeout)
+        return response.json() if response.status_code == 200 else None
+
+    def fetch(self, lat: float, lng: float) -> dict:
+        """
+        Погода и загрязнение воздуха: {'temp', 'humidity', 'aqi', 'timestamp'}.
+        Значение None - провайдер не ответил по этому показателю за отведенное время.
+        """
+        params = {'lat': lat, 'lon': lng, 'appid': self.api_key}
+        weather = self._executor.submit(self._get_json, WEATHER_URL, dict(params, units='metric'), self.deadline)
+        air = self._executor.submit(self._get_json, AIR_POLLUTION_URL, params, self.deadline)
+        # Таймаут requests - на соединение и на каждое чтение, общий срок ограничиваем здесь
+        wait((weather, air), timeout=self.deadline)
+
+        conditions = {'temp': None, 'humidity': None, 'aqi': None,
+                      'timestamp': datetime.utcnow().isoformat()}
+        errors = []
+        w_data = _result(weather, errors)
+        if w_data:
+            conditions['temp'] = w_data['main']['temp']
+            conditions['humidity'] = w_data['main']['humidity']
+        a_data = _result(air, errors)
+        if a_data:
+            conditions['aqi'] = a_data['list'][0]['main']['aqi']  # 1 (хорошо) - 5 (плохо)
+        if conditions['temp'] is None and conditions['aqi'] is None:
+            raise SensorError(f"OpenWeatherMap: {'; '.join(errors) or 'нет данных'}")
+        return conditions
+
+
+def _result(future, errors: List[str]) -> Optional[dict]:
+    """Результат запроса, если он успел завершиться без ошибки"""
+    if not future.done():
+        future.cancel()
+        errors.append('превышен срок ожидания')
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        errors.append(str(e))
+        return None
+
+
+provider = WeatherProvider()
+
+
+def sensor_list(conditions: dict, lat: float, lng: float, stale: bool = False) -> List[dict]:
+    """
+    Виртуальные датчики вокруг точки (lat, lng) по показаниям провайдера.
+    stale=True - показания не обновлены (провайдер недоступен).
+    """
+    sensors = []
+    timestamp = conditions['timestamp']
+    if conditions['temp'] is not None:
+        # Создаем виртуальный датчик температуры
+        sensors.append({
+            'sensor_id': 'TEMP-MAIN',
+            'sensor_type': 'temperature',
+            'value': conditions['temp'],
+            'timestamp': timestamp,
+            'lat': lat + 0.002,  # Слегка смещаем для отображения на карте
+            'lng': lng + 0.002
+        })
+        # Виртуальный датчик влажности
+        sensors.append({
+            'sensor_id': 'HUM-MAIN',
+            'sensor_type': 'soil_moisture',  # Используем как влажность почвы/воздуха
+            'value': conditions['humidity'],
+            'timestamp': timestamp,
+            'lat': lat - 0.002,
+            'lng': lng + 0.001
+        })
+    if conditions['aqi'] is not None:
+        # Переводим в "индекс чистоты" (100 - отлично, 0 - ужасно)
+        purity_index = 100 - ((conditions['aqi'] - 1) * 25)
+        sensors.append({
+            'sensor_id': 'AIR-QA',
+            'sensor_type': 'soil_moisture',  # Реюзинг типа для графика
+            'value': purity_index,
+            'timestamp': timestamp,
+            'lat': lat + 0.001,
+            'lng': lng - 0.003
+        })
+    for sensor in sensors:
+        sensor['stale'] = stale
+    return sensors
+
+
+def mock_sensors(lat: float, lng: float, stale: bool = False) -> List[dict]:
+    """
+    Случайные показания: демо-режим без ключа API или запасной вариант, если
+    провайдер недоступен (тогда stale=True - админка покажет "Нет связи")
+    """
+    sensors = []
+    for i in range(1, 6):
+        val = random.uniform(15, 30) if i % 2 == 0 else random.uniform(40, 80)
+        stype = 'temperature' if i % 2 == 0 else 'soil_moisture'
+        sensors.append({
+            'sensor_id': f'SENS-{i:03d}',
+            'sensor_type': stype,
+            'value': round(val, 1),
+            'timestamp': datetime.utcnow().isoformat(),
+            'lat': lat + random.uniform(-0.02, 0.02),
+            'lng': lng + random.uniform(-0.02, 0.02),
+            'stale': stale
+        })
+    return sensors
+
+
+def init_app(app) -> None:
+    provider.init_app(app)
+    sensor_cache.init_app(app)
+    breaker.cooldown = app.config.get('SENSOR_BREAKER_COOLDOWN', ConfigDefaults.SENSOR_BREAKER_COOLDOWN)
+
+
+def get_sensor_data(lat: float, lng: float) -> List[dict]:
+    """
+    Датчики для точки: показания ячейки сетки (из кэша или от провайдера).
+    Если провайдер недоступен - последние удачные показания ячейки или
+    случайные данные, помеченные stale.
+    """
+    if not provider.configured:
+        return mock_sensors(lat, lng)
+    key = cell_key(lat, lng, sensor_cache.step)
+    center_lat, center_lng = cell_center(key, sensor_cache.step)
+    try:
+        conditions = sensor_cache.get(key, lambda: provider.fetch_guarded(center_lat, center_lng))
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError):
+            logger.warning(f'Sensor API Error (using fallback): {e}')
+        conditions = sensor_cache.peek(key)
+        if conditions is None:
+            return mock_sensors(lat, lng, stale=True)
+        return sensor_list(conditions, lat, lng, stale=True)
+    return sensor_list(conditions, lat, lng)
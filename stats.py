@@ -0,0 +1,177 @@
+"""
+Ежедневная сводка показателей (DailyStats): день × город × категория × метрика.
+
+Счетчики увеличиваются инкрементально в той же транзакции, что и запись,
+которая их меняет. Редкие операции (удаления, смена статуса админом)
+пересчитывают затронутые дни из исходных таблиц через rebuild_days().
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from models import db, DailyStats, User, Problem, Complaint, Order
+from constants import StatsMetric, ProblemStatus, PointsReason
+
+
+def _day(moment: Optional[datetime]) -> date:
+    return (moment or datetime.utcnow()).date()
+
+
+def upsert_increment(model, keys: dict, column: str, delta: int) -> None:
+    """
+    Атомарно увеличить счетчик column строки с ключом keys (создать строку, если нет).
+    UPDATE ... SET col = col + delta; если строки нет - INSERT в точке сохранения,
+    при гонке с параллельной вставкой - повторный UPDATE.
+    """
+    target = getattr(model, column)
+    updated = model.query.filter_by(**keys).update({target: target + delta}, synchronize_session=False)
+    if updated:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**keys, **{column: delta}))
+    except IntegrityError:
+        model.query.filter_by(**keys).update({target: target + delta}, synchronize_session=False)
+
+
+def bump(metric: str, delta: int = 1, city: Optional[str] = None,
+         category: Optional[str] = None, day: Optional[date] = None) -> None:
+    """Увеличить показатель за день (вызывать до commit основной записи)"""
+    if not delta:
+        return
+    upsert_increment(DailyStats, {
+        'day': day or _day(None),
+        'city': city or '',
+        'category': category or '',
+        'metric': metric
+    }, 'value', delta)
+
+
+# --- Инкрементальные обновления из роутов ---
+
+def record_problem_created(problem: Problem, reporter: User) -> None:
+    bump(StatsMetric.PROBLEMS_CREATED, city=reporter.city, category=problem.category,
+         day=_day(problem.created_at))
+
+
+def record_problem_completed(problem: Problem) -> None:
+    city = problem.user.city if problem.user else None
+    bump(StatsMetric.PROBLEMS_COMPLETED, city=city, category=problem.category,
+         day=_day(problem.completed_at))
+
+
+def record_complaint(complaint: Complaint, user: User, problem: Optional[Problem]) -> None:
+    bump(StatsMetric.complaint(complaint.reason), city=user.city,
+         category=problem.category if problem else None, day=_day(complaint.created_at))
+
+
+def record_order(user: User) -> None:
+    bump(StatsMetric.ORDERS, city=user.city)
+
+
+def record_points_issued(user: User, amount: int, reason: Optional[str] = None) -> None:
+    """Начисленные (не потраченные) баллы; правки администратора и сверки не считаются"""
+    if amount > 0 and reason not in PointsReason.NOT_EARNED:
+        bump(StatsMetric.POINTS_ISSUED, amount, city=user.city)
+
+
+# --- Пересчет (компактизация) из исходных таблиц ---
+
+def rebuild_days(days: Iterable[Optional[date]]) -> None:
+    """Пересчитать сводку за указанные дни (например, после удаления записей)"""
+    for day in sorted({d for d in days if d}):
+        rebuild(day, day)
+
+
+def rebuild(day_from: Optional[date] = None, day_to: Optional[date] = None) -> int:
+    """
+    Пересчитать сводку за диапазон дней (по умолчанию - за всю историю).
+    Начисленные баллы не восстанавливаются из таблиц и сохраняются как есть.
+    Возвращает число записанных строк. Commit выполняет вызывающий код.
+    """
+    if day_from is None:
+        first = db.session.query(func.min(Problem.created_at)).scalar()
+        day_from = _day(first)
+    day_to = day_to or _day(None)
+    start = datetime.combine(day_from, datetime.min.time())
+    end = datetime.combine(day_to + timedelta(days=1), datetime.min.time())
+
+    DailyStats.query.filter(
+        DailyStats.day >= day_from, DailyStats.day <= day_to,
+        DailyStats.metric != StatsMetric.POINTS_ISSUED
+    ).delete(synchronize_session=False)
+
+    rows: Dict[tuple, int] = {}
+
+    def add(metric, query):
+        for day, city, category, value in query:
+            key = (_parse_day(day), city or '', category or '', metric)
+            rows[key] = rows.get(key, 0) + value
+
+    reporter = aliased(User)
+    add(StatsMetric.PROBLEMS_CREATED, db.session.query(
+        func.date(Problem.created_at), reporter.city, Problem.category, func.count(Problem.id))
+        .outerjoin(reporter, Problem.user_id == reporter.id)
+        .filter(Problem.created_at >= start, Problem.created_at < end)
+        .group_by(func.date(Problem.created_at), reporter.city, Problem.category))
+    add(StatsMetric.PROBLEMS_COMPLETED, db.session.query(
+        func.date(Problem.completed_at), reporter.city, Problem.category, func.count(Problem.id))
+        .outerjoin(reporter, Problem.user_id == reporter.id)
+        .filter(Problem.status == ProblemStatus.COMPLETED,
+                Problem.completed_at >= start, Problem.completed_at < end)
+        .group_by(func.date(Problem.completed_at), reporter.city, Problem.category))
+    add(StatsMetric.ORDERS, db.session.query(
+        func.date(Order.created_at), User.city, db.literal(''), func.count(Order.id))
+        .outerjoin(User, Order.user_id == User.id)
+        .filter(Order.created_at >= start, Order.created_at < end)
+        .group_by(func.date(Order.created_at), User.city))
+    for reason, in db.session.query(Complaint.reason).filter(
+            Complaint.created_at >= start, Complaint.created_at < end).distinct():
+        add(StatsMetric.complaint(reason), db.session.query(
+            func.date(Complaint.created_at), User.city, Problem.category, func.count(Complaint.id))
+            .outerjoin(User, Complaint.user_id == User.id)
+            .outerjoin(Problem, Complaint.problem_id == Problem.id)
+            .filter(Complaint.created_at >= start, Complaint.created_at < end,
+                    Complaint.reason == reason)
+            .group_by(func.date(Complaint.created_at), User.city, Problem.category))
+
+    for (day, city, category, metric), value in rows.items():
+        db.session.add(DailyStats(day=day, city=city, category=category, metric=metric, value=value))
+    return len(rows)
+
+
+def _parse_day(value) -> date:
+    """func.date() в SQLite возвращает строку, в других СУБД - date"""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+# --- Чтение для дашбордов ---
+
+def metric_total(metric: str, day_from: Optional[date] = None, day_to: Optional[date] = None,
+                 city: Optional[str] = None) -> int:
+    query = db.session.query(func.coalesce(func.sum(DailyStats.value), 0)).filter(DailyStats.metric == metric)
+    if day_from:
+        query = query.filter(DailyStats.day >= day_from)
+    if day_to:
+        query = query.filter(DailyStats.day <= day_to)
+    if city:
+        query = query.filter(DailyStats.city == city)
+    return query.scalar()
+
+
+def metric_by_category(metric: str) -> Dict[str, int]:
+    return dict(db.session.query(DailyStats.category, func.sum(DailyStats.value))
+                .filter(DailyStats.metric == metric)
+                .group_by(DailyStats.category).all())
+
+
+def complaint_reasons(day_from: date) -> Dict[str, int]:
+    """Количество жалоб по причинам начиная с day_from"""
+    rows = (db.session.query(DailyStats.metric, func.sum(DailyStats.value))
+            .filter(DailyStats.metric.startswith(StatsMetric.COMPLAINT_PREFIX),
+                    DailyStats.day >= day_from)
+            .group_by(DailyStats.metric).all())
+    return {metric[len(StatsMetric.COMPLAINT_PREFIX):]: value for metric, value in rows if value}
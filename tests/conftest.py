@@ -0,0 +1,52 @@
+"""
+Общие фикстуры: приложение на временной SQLite-базе и вход под пользователем.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Config читает DATABASE_URL при импорте, поэтому база задается до импорта app
+_db_file = tempfile.NamedTemporaryFile(prefix='ecopulse-test-', suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = 'sqlite:///' + _db_file.name
+
+
+@pytest.fixture
+def app():
+    from app import app as flask_app, init_db
+    from models import db
+    from leaderboard import leaderboards
+    from markers import marker_snapshot
+
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+    init_db()
+    leaderboards.clear()
+    marker_snapshot.bump()
+    yield flask_app
+
+
+@pytest.fixture
+def admin_client(app):
+    from models import User
+
+    client = app.test_client()
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    return client
+
+
+def pytest_sessionfinish(session, exitstatus):
+    try:
+        os.unlink(_db_file.name)
+    except OSError:
+        pass
@@ -0,0 +1,46 @@
+"""
+Продолжение потока событий по Last-Event-ID.
+"""
+from events import EventHub
+
+
+def _drain(sub):
+    events = []
+    while not sub.queue.empty():
+        events.append(sub.queue.get_nowait())
+    return events
+
+
+def test_replay_missed_events():
+    hub = EventHub(max_queue=100, history=200)
+    for i in range(30):
+        hub.publish('problem_updated', {'id': i})
+
+    sub = hub.subscribe(last_event_id='10')
+
+    assert not sub.lagging
+    assert [event[0] for event in _drain(sub)] == list(range(11, 31))
+
+
+def test_backlog_larger_than_queue_requests_resync():
+    hub = EventHub(max_queue=100, history=200)
+    for i in range(150):
+        hub.publish('problem_updated', {'id': i})
+
+    sub = hub.subscribe(last_event_id='10')
+
+    assert sub.lagging
+    assert sub.queue.empty()
+    stream = hub.stream(sub)
+    next(stream)  # retry:
+    assert 'event: resync' in next(stream)
+
+
+def test_admin_only_events_not_replayed_to_users():
+    hub = EventHub(max_queue=100, history=200)
+    hub.publish('complaint_filed', {'id': 1}, admin_only=True)
+    hub.publish('problem_updated', {'id': 2})
+
+    sub = hub.subscribe(last_event_id='0')
+
+    assert [event[1] for event in _drain(sub)] == ['problem_updated']
@@ -0,0 +1,88 @@
+"""
+Число SQL-запросов списочных эндпоинтов не должно расти с числом строк (N+1).
+
+Для каждого эндпоинта база заполняется N и 2N записями (каждая со своими
+пользователями, чтобы карта идентичности не скрывала ленивые загрузки),
+и число запросов сравнивается.
+"""
+from datetime import datetime
+
+import pytest
+
+from querylog import count_queries
+
+N = 4
+
+
+def _user(db, User, name):
+    user = User(username=name, email=f'{name}@test.ru', points=0)
+    user.set_password('secret')
+    db.session.add(user)
+    return user
+
+
+def _problem(db, Problem, reporter, **fields):
+    problem = Problem(lat=53.99, lng=86.66, title=f'Проблема {reporter.username}', description='Описание',
+                      user=reporter, **fields)
+    db.session.add(problem)
+    return problem
+
+
+def seed(kind, count):
+    """Добавить count записей вида kind, каждая - со своими пользователями"""
+    from models import db, User, Problem, Complaint, Comment, TaskCompletion, Order
+    from constants import ProblemStatus
+
+    # Комментарии копятся у одной и той же проблемы
+    target = Problem.query.filter_by(title='Проблема target').first()
+    if target is None:
+        target = _problem(db, Problem, _user(db, User, 'target'))
+    for i in range(count):
+        suffix = f'{kind}-{i}-{User.query.count()}'
+        author = _user(db, User, f'author-{suffix}')
+        if kind == 'problems':
+            _problem(db, Problem, author)
+        elif kind == 'completed':
+            worker = _user(db, User, f'worker-{suffix}')
+            problem = _problem(db, Problem, author, status=ProblemStatus.COMPLETED, is_completed=True,
+                               worker=worker, completed_at=datetime.utcnow())
+            db.session.add(TaskCompletion(problem_report=problem, user=worker, description='Готово'))
+        elif kind == 'complaints':
+            problem = _problem(db, Problem, _user(db, User, f'reporter-{suffix}'))
+            db.session.add(Complaint(problem=problem, user=author, reason='spam'))
+        elif kind == 'orders':
+            db.session.add(Order(user=author, item_name='Футболка', price=100, quantity=1))
+        elif kind == 'comments':
+            db.session.add(Comment(problem_comment=target, user=author, text='Комментарий'))
+    db.session.commit()
+    return target.id
+
+
+ENDPOINTS = [
+    ('complaints', lambda target: '/api/complaints/all'),
+    ('orders', lambda target: '/api/orders'),
+    ('comments', lambda target: f'/api/comments/{target}'),
+    ('completed', lambda target: '/completed_tasks'),
+    ('problems', lambda target: '/api/admin/problems'),
+    ('problems', lambda target: '/api/admin/users'),
+    ('complaints', lambda target: '/admin'),
+    ('complaints', lambda target: '/admin/profile'),
+]
+
+
+def _queries(app, client, kind, url, count):
+    with app.app_context():
+        target = seed(kind, count)
+    with count_queries() as counter:
+        response = client.get(url(target))
+    assert response.status_code == 200, response.data[:200]
+    return counter.count
+
+
+@pytest.mark.parametrize('kind, url', ENDPOINTS, ids=[url('<id>') for _, url in ENDPOINTS])
+def test_query_count_does_not_grow_with_rows(app, admin_client, kind, url):
+    # Первый запрос прогревает кэши (рейтинги, каталоги), его не считаем
+    _queries(app, admin_client, kind, url, 1)
+    few = _queries(app, admin_client, kind, url, N)
+    many = _queries(app, admin_client, kind, url, N)
+    assert many == few, f'{url("<id>")}: {few} запросов при {N + 1} записях, {many} при {2 * N + 1}'
@@ -0,0 +1,11 @@
+"""
+Частые запросы должны использовать индексы (EXPLAIN QUERY PLAN, как в flask check-indexes).
+"""
+from migrations import check_query_plans
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        failures = check_query_plans()
+    assert failures == [], '\n'.join(f'{name}: ожидался {" или ".join(indexes)}, план: {plan}'
+                                     for name, indexes, plan in failures)
@@ -0,0 +1,128 @@
+"""
+Запросы к провайдеру погоды на локальном HTTP-сервере-заглушке (127.0.0.1):
+параллельность, общий срок и single-flight в кэше показаний.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import sensors
+
+WEATHER = {'main': {'temp': 21.5, 'humidity': 40}}
+AIR = {'list': [{'main': {'aqi': 2}}]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delays = {}
+    hits = Counter()
+
+    def do_GET(self):
+        path = self.path.split('?')[0].strip('/')
+        self.hits[path] += 1
+        time.sleep(self.delays.get(path, 0))
+        body = json.dumps(WEATHER if path == 'weather' else AIR).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # Клиент уже ушел по таймауту
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    StubHandler.delays = {}
+    StubHandler.hits = Counter()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    monkeypatch.setattr(sensors, 'WEATHER_URL', base + '/weather')
+    monkeypatch.setattr(sensors, 'AIR_POLLUTION_URL', base + '/air')
+    yield StubHandler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def provider():
+    return sensors.WeatherProvider(api_key='test', deadline=2.0)
+
+
+def test_requests_run_concurrently(stub, provider):
+    stub.delays = {'weather': 0.5, 'air': 0.5}
+    provider.fetch(54.0, 86.65)  # Соединения в пуле
+    started = time.monotonic()
+    conditions = provider.fetch(54.0, 86.65)
+    elapsed = time.monotonic() - started
+
+    assert conditions['temp'] == 21.5 and conditions['aqi'] == 2
+    # Последовательно было бы не меньше 1.0 с
+    assert elapsed < 0.9
+
+
+def test_deadline_drops_slow_request(stub, provider):
+    stub.delays = {'weather': 1.5, 'air': 0.05}
+    provider.deadline = 0.4
+    started = time.monotonic()
+    conditions = provider.fetch(54.0, 86.65)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 0.8
+    assert conditions['temp'] is None and conditions['aqi'] == 2
+
+
+def test_deadline_with_no_data_raises(stub, provider):
+    stub.delays = {'weather': 1.5, 'air': 1.5}
+    provider.deadline = 0.3
+    started = time.monotonic()
+    with pytest.raises(sensors.SensorError):
+        provider.fetch(54.0, 86.65)
+    assert time.monotonic() - started < 0.8
+
+
+def test_single_flight_for_concurrent_misses(stub, provider):
+    stub.delays = {'weather': 0.3, 'air': 0.3}
+    cache = sensors.SensorCache(step=0.05, ttl=60)
+    key = sensors.cell_key(54.0, 86.65, cache.step)
+    results = []
+
+    def viewer():
+        results.append(cache.get(key, lambda: provider.fetch(54.0, 86.65)))
+
+    threads = [threading.Thread(target=viewer) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 20 and all(r['temp'] == 21.5 for r in results)
+    assert stub.hits == Counter({'weather': 1, 'air': 1})
+
+    # Повторный запрос той же ячейки - из кэша
+    cache.get(key, lambda: provider.fetch(54.0, 86.65))
+    assert stub.hits == Counter({'weather': 1, 'air': 1})
+
+
+def test_demo_mode_is_not_stale(monkeypatch):
+    monkeypatch.setattr(sensors.provider, 'api_key', None)
+    assert not any(s['stale'] for s in sensors.get_sensor_data(54.0, 86.65))
+
+
+def test_fallback_without_cache_is_stale(monkeypatch):
+    def fail(lat, lng):
+        raise sensors.SensorError('нет связи')
+
+    monkeypatch.setattr(sensors.provider, 'api_key', 'test')
+    monkeypatch.setattr(sensors.provider, 'fetch_guarded', fail)
+    monkeypatch.setattr(sensors, 'sensor_cache', sensors.SensorCache(step=0.05, ttl=60))
+    assert all(s['stale'] for s in sensors.get_sensor_data(54.0, 86.65))
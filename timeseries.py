@@ -0,0 +1,190 @@
+"""
+Временные ряды для аналитики: проблемы (созданные/выполненные), жалобы и заказы
+по часам, дням или неделям с разбивкой по категориям.
+
+Подсчет - GROUP BY по выражению "начало интервала" над индексированными
+created_at/completed_at. Закрытые (уже завершившиеся) интервалы кэшируются:
+новые записи в них не попадают, а удаления и правка истории вызывают invalidate_days().
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from models import db, Problem, Complaint, Order
+from constants import ProblemStatus
+
+BUCKET_SIZES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+# Диапазон по умолчанию, если date_from не указан
+DEFAULT_RANGES = {
+    'hour': timedelta(days=2),
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=12),
+}
+
+MAX_BUCKETS = 1000
+
+# Интервал считается закрытым, если закончился хотя бы столько времени назад
+CLOSED_BUCKET_SKEW = timedelta(seconds=5)
+
+_LABEL_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def bucket_start(moment: datetime, bucket: str) -> datetime:
+    """Начало интервала, в который попадает moment (недели начинаются с понедельника)"""
+    if bucket == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    start = datetime.combine(moment.date(), datetime.min.time())
+    if bucket == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def bucket_expr(column, bucket: str):
+    """SQL-выражение начала интервала (строка в формате _LABEL_FORMAT, SQLite)"""
+    if bucket == 'hour':
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+    if bucket == 'week':
+        return func.strftime('%Y-%m-%d 00:00:00', column, 'weekday 0', '-6 days')
+    return func.strftime('%Y-%m-%d 00:00:00', column)
+
+
+# Показатель: (колонка времени, колонка категории или None, что считаем)
+METRICS = {
+    'reported': (Problem.created_at, Problem.category, Problem.id),
+    'completed': (Problem.completed_at, Problem.category, Problem.id),
+    'complaints': (Complaint.created_at, Problem.category, Complaint.id),
+    'orders': (Order.created_at, None, Order.id),
+}
+
+
+def _count(metric: str, bucket: str, start: datetime, end: datetime) -> Dict[datetime, Dict[str, int]]:
+    """Количество по интервалам и категориям в диапазоне [start, end)"""
+    time_column, category_column, id_column = METRICS[metric]
+    label = bucket_expr(time_column, bucket)
+    group_by = [label] if category_column is None else [label, category_column]
+    query = db.session.query(*group_by, func.count(id_column))
+    if metric == 'complaints':
+        query = query.select_from(Complaint).outerjoin(Problem, Complaint.problem_id == Problem.id)
+    elif metric == 'completed':
+        query = query.filter(Problem.status == ProblemStatus.COMPLETED)
+    rows = query.filter(time_column >= start, time_column < end).group_by(*group_by).all()
+
+    result: Dict[datetime, Dict[str, int]] = {}
+    for row in rows:
+        category = (row[1] or '') if category_column is not None else ''
+        by_category = result.setdefault(datetime.strptime(row[0], _LABEL_FORMAT), {})
+        by_category[category] = by_category.get(category, 0) + row[-1]
+    return result
+
+
+class BucketCache:
+    """
+    LRU-кэш посчитанных закрытых интервалов: (показатель, размер, начало) -> {категория: количество}.
+    Поколение (generation) защищает от сохранения результата, посчитанного до invalidate_days().
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Dict[str, int]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value: Dict[str, int], generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_days(self, days: Iterable[Optional[date]]) -> None:
+        """Сбросить интервалы, пересекающиеся с указанными днями (после удаления или правки данных)"""
+        days = {d for d in days if d}
+        if not days:
+            return
+        with self._lock:
+            self.generation += 1
+            for key in list(self._entries):
+                _, bucket, start = key
+                end = start + BUCKET_SIZES[bucket]
+                if any(start < datetime.combine(d + timedelta(days=1), datetime.min.time())
+                       and datetime.combine(d, datetime.min.time()) < end for d in days):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+timeseries_cache = BucketCache()
+
+
+def bucket_range(bucket: str, date_from: Optional[datetime], date_to: Optional[datetime]) -> Tuple[datetime, datetime]:
+    """
+    Выровненный по интервалам диапазон [start, end); date_to - включительно.
+    Число интервалов ограничено MAX_BUCKETS (обрезается начало диапазона).
+    """
+    size = BUCKET_SIZES[bucket]
+    end_moment = date_to or datetime.utcnow()
+    end = bucket_start(end_moment, bucket) + size
+    start = bucket_start(date_from or end_moment - DEFAULT_RANGES[bucket], bucket)
+    if start >= end:
+        start = end - size
+    if (end - start) / size > MAX_BUCKETS:
+        start = end - size * MAX_BUCKETS
+    return start, end
+
+
+def time_series(bucket: str, start: datetime, end: datetime, metrics: List[str]) -> dict:
+    """
+    Ряды показателей по интервалам [start, end) (границы уже выровнены bucket_range).
+    Для каждого показателя - общий ряд и ряды по категориям, выровненные по labels.
+    """
+    size = BUCKET_SIZES[bucket]
+    starts = []
+    moment = start
+    while moment < end:
+        starts.append(moment)
+        moment += size
+    closed_before = datetime.utcnow() - CLOSED_BUCKET_SKEW
+
+    series = {}
+    for metric in metrics:
+        generation = timeseries_cache.generation
+        buckets = {s: timeseries_cache.get((metric, bucket, s)) for s in starts}
+        missing = [s for s, value in buckets.items() if value is None]
+        if missing:
+            # Один запрос на весь непросчитанный хвост/разрыв диапазона
+            counted = _count(metric, bucket, missing[0], missing[-1] + size)
+            for s in missing:
+                buckets[s] = counted.get(s, {})
+                if s + size <= closed_before:
+                    timeseries_cache.put((metric, bucket, s), buckets[s], generation)
+
+        categories = sorted({c for value in buckets.values() for c in value})
+        series[metric] = {
+            'total': [sum(buckets[s].values()) for s in starts],
+            'by_category': {c: [buckets[s].get(c, 0) for s in starts] for c in categories if c}
+        }
+
+    return {
+        'bucket': bucket,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'labels': [s.isoformat() for s in starts],
+        'series': series
+    }
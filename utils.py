@@ -4,7 +4,7 @@
 import os
 from werkzeug.utils import secure_filename
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from flask import current_app
 
 def save_uploaded_file(file, prefix: str = 'file') -> Optional[str]:
@@ -60,6 +60,18 @@ def json_response(status: str = 'success', data: dict = None,
     return response, code
 
 
+def parse_id_list(value: Optional[str]) -> List[int]:
+    """
+    Разбирает список id вида "1,2,3" (некорректные элементы пропускаются)
+    """
+    ids = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if part.isdigit():
+            ids.append(int(part))
+    return ids
+
+
 def is_valid_image_file(filename: str) -> bool:
     """
     Проверяет, является ли файл изображением по расширению
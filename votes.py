@@ -0,0 +1,202 @@
+"""
+Голоса за проблемы.
+
+Строка Vote - источник истины. Счетчики Problem.likes/dislikes меняются
+атомарным UPDATE ... SET likes = likes + :delta, без чтения проблемы в Python.
+В режиме буферизации (VOTE_BUFFERING) приращения копятся в памяти и
+записываются пачкой раз в VOTE_FLUSH_INTERVAL секунд одним executemany,
+чтобы популярная проблема не становилась точкой конкуренции за запись.
+Пересчитать счетчики из таблицы Vote можно через rebuild_counts().
+"""
+import atexit
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, event, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import db, Problem, Vote
+from constants import ConfigDefaults
+
+VOTE_TYPES = ('like', 'dislike')
+
+logger = logging.getLogger(__name__)
+
+
+def _deltas(old: Optional[str], new: Optional[str]) -> Tuple[int, int]:
+    """Изменение (likes, dislikes) при смене голоса old -> new (None - нет голоса)"""
+    likes = (new == 'like') - (old == 'like')
+    dislikes = (new == 'dislike') - (old == 'dislike')
+    return likes, dislikes
+
+
+def _apply(problem_id: int, likes: int, dislikes: int) -> None:
+    if likes or dislikes:
+        db.session.execute(update(Problem).where(Problem.id == problem_id)
+                           .values(likes=func.coalesce(Problem.likes, 0) + likes,
+                                   dislikes=func.coalesce(Problem.dislikes, 0) + dislikes)
+                           .execution_options(synchronize_session=False))
+
+
+class VoteBuffer:
+    """
+    Буфер приращений счетчиков голосов: problem_id -> [likes, dislikes].
+    Фоновый поток раз в interval секунд записывает накопленное одной транзакцией
+    и вызывает on_flush(problem_ids) для сброса кэшей и уведомлений.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.interval = 1.0
+        self.on_flush: Optional[Callable[[List[int]], None]] = None
+        self._app = None
+        self._pending: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def init_app(self, app, on_flush: Optional[Callable[[List[int]], None]] = None) -> None:
+        self._app = app
+        self.enabled = app.config.get('VOTE_BUFFERING', ConfigDefaults.VOTE_BUFFERING)
+        self.interval = app.config.get('VOTE_FLUSH_INTERVAL', ConfigDefaults.VOTE_FLUSH_INTERVAL)
+        self.on_flush = on_flush
+        if self.enabled:
+            atexit.register(self.flush)
+
+    def add(self, problem_id: int, likes: int, dislikes: int) -> None:
+        with self._lock:
+            pending = self._pending.setdefault(problem_id, [0, 0])
+            pending[0] += likes
+            pending[1] += dislikes
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='vote-flusher', daemon=True)
+                self._thread.start()
+
+    def pending(self, problem_ids: Iterable[int]) -> Dict[int, Tuple[int, int]]:
+        with self._lock:
+            return {pid: tuple(self._pending[pid]) for pid in problem_ids if pid in self._pending}
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> int:
+        """Записать накопленные приращения. Возвращает число затронутых проблем"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        rows = [{'problem_id': pid, 'likes': d[0], 'dislikes': d[1]}
+                for pid, d in batch.items() if d[0] or d[1]]
+        if not rows:
+            return 0
+        try:
+            with self._app.app_context():
+                table = Problem.__table__
+                db.session.execute(
+                    table.update().where(table.c.id == bindparam('problem_id'))
+                    .values(likes=func.coalesce(table.c.likes, 0) + bindparam('likes'),
+                            dislikes=func.coalesce(table.c.dislikes, 0) + bindparam('dislikes')),
+                    rows)
+                db.session.commit()
+        except Exception:
+            logger.exception('Не удалось записать счетчики голосов, повтор при следующем сбросе')
+            with self._lock:
+                for pid, (likes, dislikes) in batch.items():
+                    pending = self._pending.setdefault(pid, [0, 0])
+                    pending[0] += likes
+                    pending[1] += dislikes
+            return 0
+        if self.on_flush:
+            with self._app.app_context():
+                self.on_flush([row['problem_id'] for row in rows])
+        return len(rows)
+
+
+vote_buffer = VoteBuffer()
+
+
+def cast_vote(user_id: int, problem_id: int, vote_type: str,
+              toggle: bool = True) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Проголосовать: повторный голос того же типа снимает голос (при toggle=False
+    оставляет как есть), другой тип - меняет.
+    Пишет строку Vote и приращения счетчиков (сразу или, при буферизации, в буфер
+    после успешного commit).
+    Возвращает (прежний голос, текущий голос), None - нет голоса. Commit выполняет вызывающий код.
+    """
+    vote = Vote.query.filter_by(problem_id=problem_id, user_id=user_id).first()
+    old = vote.vote_type if vote else None
+    if vote is None:
+        # INSERT OR IGNORE вместо точки сохранения: в pysqlite SAVEPOINT до первой записи
+        # транзакции фиксируется сразу и не откатывался бы вместе с запросом
+        inserted = db.session.execute(
+            sqlite_insert(Vote).values(problem_id=problem_id, user_id=user_id, vote_type=vote_type)
+            .on_conflict_do_nothing(index_elements=['problem_id', 'user_id'])).rowcount
+        if not inserted:
+            # Параллельный запрос того же пользователя успел создать голос - его и учитываем
+            current = Vote.query.filter_by(problem_id=problem_id, user_id=user_id).first().vote_type
+            return current, current
+        new = vote_type
+    elif old == vote_type:
+        if not toggle:
+            return old, old
+        db.session.delete(vote)
+        new = None
+    else:
+        vote.vote_type = vote_type
+        new = vote_type
+
+    likes, dislikes = _deltas(old, new)
+    if vote_buffer.enabled:
+        if likes or dislikes:
+            db.session.info.setdefault('vote_deltas', []).append((problem_id, likes, dislikes))
+    else:
+        _apply(problem_id, likes, dislikes)
+    return old, new
+
+
+# Приращения попадают в буфер только после commit строки Vote: иначе при откате
+# транзакции счетчики разошлись бы с таблицей голосов
+
+@event.listens_for(Session, 'after_commit')
+def _buffer_vote_deltas(session):
+    # Фиксация точки сохранения (begin_nested) - еще не commit всей транзакции
+    if session.in_nested_transaction():
+        return
+    for problem_id, likes, dislikes in session.info.pop('vote_deltas', ()):
+        vote_buffer.add(problem_id, likes, dislikes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_vote_deltas(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('vote_deltas', None)
+
+
+def counts(problem_ids: Iterable[int]) -> Dict[int, Tuple[int, int]]:
+    """Актуальные (likes, dislikes) с учетом еще не записанных приращений"""
+    problem_ids = list(problem_ids)
+    if not problem_ids:
+        return {}
+    result = {pid: (likes or 0, dislikes or 0) for pid, likes, dislikes in
+              db.session.execute(select(Problem.id, Problem.likes, Problem.dislikes)
+                                 .where(Problem.id.in_(problem_ids)))}
+    for pid, (likes, dislikes) in vote_buffer.pending(result).items():
+        current = result[pid]
+        result[pid] = (current[0] + likes, current[1] + dislikes)
+    return result
+
+
+def rebuild_counts(problem_ids: Optional[List[int]] = None) -> None:
+    """Пересчитать счетчики из таблицы Vote (все или указанные проблемы)"""
+    vote_buffer.flush()
+
+    def total(vote_type):
+        return (select(func.count(Vote.id))
+                .where(Vote.problem_id == Problem.id, Vote.vote_type == vote_type)
+                .scalar_subquery())
+
+    stmt = update(Problem).values(likes=total('like'), dislikes=total('dislike'))
+    if problem_ids is not None:
+        stmt = stmt.where(Problem.id.in_(problem_ids))
+    db.session.execute(stmt.execution_options(synchronize_session=False))